@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+
+import metrics
+from design import N_ALTERNATIVES, effects_code, get_design
+
+# --------------------------- Adaptive Choice Tasks ---------------------------
+
+# With SURVEY_ADAPTIVE=1 only the first task comes from the respondent's design
+# version. Every later task is picked from the full factorial to be the most
+# informative about that respondent's current utility estimate.
+ENABLED = os.environ.get("SURVEY_ADAPTIVE", "0") == "1"
+
+PRIOR_PRECISION = 1.0  # N(0, I) prior on effects-coded part-worths
+N_CANDIDATES = 256     # random starting choice sets per selection
+EXCHANGE_PASSES = 2    # coordinate-exchange sweeps over each alternative
+
+
+class CandidateSet:
+    """Effects-coded full factorial for one attribute table, shared by every adaptive session"""
+
+    def __init__(self, table):
+        self.codes, _ = get_design(table.as_dict())
+        self.X = effects_code(self.codes, table.levels)
+        self.X.flags.writeable = False
+        self.n_params = self.X.shape[1]
+
+
+_candidate_cache = {}
+
+
+def get_candidate_set(table):
+    candidates = _candidate_cache.get(table.key)
+    if candidates is None:
+        candidates = _candidate_cache.setdefault(table.key, CandidateSet(table))
+    return candidates
+
+
+class UtilityEstimate:
+    """Gaussian approximation of one respondent's effects-coded part-worths
+
+    Each answer is folded in with a single online Newton step (Laplace
+    approximation), so an update is O(n_params^2) work regardless of how many
+    tasks came before.
+    """
+
+    def __init__(self, n_params, prior_precision=PRIOR_PRECISION):
+        self.mean = np.zeros(n_params)
+        self.precision = np.eye(n_params) * prior_precision
+
+    def update(self, X, chosen):
+        p = _softmax(X @ self.mean)
+        self.precision += X.T @ ((np.diag(p) - np.outer(p, p)) @ X)
+        y = np.zeros(len(X))
+        y[chosen] = 1.0
+        self.mean += np.linalg.solve(self.precision, X.T @ (y - p))
+
+
+def _softmax(u):
+    e = np.exp(u - u.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def _information_gain(G, p):
+    """det(I + W G) per choice set, i.e. det(H + X'WX) / det(H) with G = X Sigma X' and W the MNL weights"""
+    M = np.eye(N_ALTERNATIVES) + (p[:, :, None] * (np.eye(N_ALTERNATIVES) - p[:, None, :])) @ G
+    # Closed-form 3x3 determinant; batched LAPACK calls cost more than the arithmetic here
+    (a, b, c), (d, e, f), (g, h, i) = M[:, 0].T, M[:, 1].T, M[:, 2].T
+    return a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+
+
+_rng = np.random.default_rng()
+
+
+@metrics.timed("survey_adaptive_select")
+def select_task(candidates, estimate, rng=None):
+    """Design indices of the most informative next choice set
+
+    Bayesian D-optimal search: the best of N_CANDIDATES random sets, then
+    coordinate exchange that tries every profile of the full factorial in each
+    position. An exchange sweep only needs x_j Sigma x_k for the candidate
+    against the two fixed profiles, so it is O(n_profiles) per position.
+    """
+    rng = rng or _rng
+    X = candidates.X
+    n = len(X)
+    utilities = X @ estimate.mean
+    projected = X @ np.linalg.inv(estimate.precision)
+    own = np.einsum('nd,nd->n', projected, X)  # x_j Sigma x_j for every profile
+
+    triples = rng.choice(n, size=(N_CANDIDATES, N_ALTERNATIVES))
+    G = np.einsum('kad,kbd->kab', projected[triples], X[triples])
+    gain = _information_gain(G, _softmax(utilities[triples]))
+    gain[(triples[:, 0] == triples[:, 1]) | (triples[:, 0] == triples[:, 2]) | (triples[:, 1] == triples[:, 2])] = -np.inf
+    best = triples[np.argmax(gain)]
+
+    for _ in range(EXCHANGE_PASSES):
+        previous = best.copy()
+        for slot in range(N_ALTERNATIVES):
+            cross = projected @ X[best].T  # (n, 3): candidate against each current profile
+            G = np.repeat((X[best] @ projected[best].T)[None], n, axis=0)
+            G[:, slot, :] = cross
+            G[:, :, slot] = cross
+            G[:, slot, slot] = own
+            u = np.repeat(utilities[best][None], n, axis=0)
+            u[:, slot] = utilities
+            gain = _information_gain(G, _softmax(u))
+            # A set showing the same profile twice is not a valid task
+            gain[np.delete(best, slot)] = -np.inf
+            best = best.copy()
+            best[slot] = np.argmax(gain)
+        if (best == previous).all():
+            break
+    return best
+
+
+def next_task(table, codes, estimate, task_num, chosen):
+    """Fold the answer to task task_num into estimate and write the next choice set into codes in place"""
+    candidates = get_candidate_set(table)
+    start = (task_num - 1) * N_ALTERNATIVES
+    estimate.update(effects_code(codes[start:start + N_ALTERNATIVES], table.levels), chosen)
+    if start + N_ALTERNATIVES < len(codes):
+        codes[start + N_ALTERNATIVES:start + 2 * N_ALTERNATIVES] = candidates.codes[select_task(candidates, estimate)]
+
+
+def new_estimate(table):
+    return UtilityEstimate(sum(table.levels) - len(table.levels))
+
+
+def replay(table, codes, choices):
+    """Rebuild the estimate of a resumed session from the tasks it has already answered"""
+    estimate = new_estimate(table)
+    for task, chosen in enumerate(choices):
+        start = task * N_ALTERNATIVES
+        estimate.update(effects_code(codes[start:start + N_ALTERNATIVES], table.levels), chosen)
+    return estimate
@@ -0,0 +1,66 @@
+import threading
+
+# --------------------------- Respondent Counts ---------------------------
+
+# Column order of the Respondents_Data A2:D2 range
+COUNT_COLUMNS = ["Total", "Private", "Commercial", "No Vehicle"]
+COUNTS_RANGE = "A2:D2"
+
+# Full re-count of Final_Responses every N count updates per process, to repair
+# increments lost to concurrent writers.
+RECONCILE_EVERY = 50
+
+_lock = threading.Lock()
+_submissions_since_reconcile = None  # None until the first reconcile in this process
+
+
+def respondent_bucket(vehicle_kind):
+    if 'Private' in vehicle_kind or 'Own Vehicle' in vehicle_kind:
+        return "Private"
+    if 'Commercial' in vehicle_kind:
+        return "Commercial"
+    return "No Vehicle"
+
+
+def vehicle_kind_of(record):
+    return record.get("Vehicle Kind", "") or record.get("Ownership", "")
+
+
+def count_respondents(records):
+    """Full count over Final_Responses records, one vote per respondent id"""
+    unique_respondents = {}
+    for row in records:
+        respondent_id = row.get("Respondent id", "")
+        if respondent_id and respondent_id not in unique_respondents:
+            unique_respondents[respondent_id] = vehicle_kind_of(row)
+
+    counts = dict.fromkeys(COUNT_COLUMNS, 0)
+    counts["Total"] = len(unique_respondents)
+    for vehicle_kind in unique_respondents.values():
+        counts[respondent_bucket(vehicle_kind)] += 1
+    return [counts[c] for c in COUNT_COLUMNS]
+
+
+def increment_counts(current, vehicle_kinds):
+    """Add newly submitted respondents to a stored [total, private, commercial, none] row"""
+    counts = []
+    for i in range(len(COUNT_COLUMNS)):
+        try:
+            counts.append(int(current[i]))
+        except (IndexError, TypeError, ValueError):
+            counts.append(0)
+    for vehicle_kind in vehicle_kinds:
+        counts[0] += 1
+        counts[COUNT_COLUMNS.index(respondent_bucket(vehicle_kind))] += 1
+    return counts
+
+
+def reconcile_due():
+    """Return True when the caller should do a full re-count instead of an increment"""
+    global _submissions_since_reconcile
+    with _lock:
+        if _submissions_since_reconcile is None or _submissions_since_reconcile >= RECONCILE_EVERY:
+            _submissions_since_reconcile = 0
+            return True
+        _submissions_since_reconcile += 1
+        return False
@@ -0,0 +1,453 @@
+"""Choice-model estimation over stored survey responses.
+
+Run with: python analysis.py mnl [--bootstrap 200] [--workers 4] [--vehicle-class "2 wheeler"]
+          python analysis.py hb [--chains 4] [--iterations 2000] [--checkpoint-dir hb] [--output utilities.csv]
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import storage
+from design import N_ALTERNATIVES, effects_code, get_attributes
+
+# --------------------------- Level Encoding ---------------------------
+
+# Both attribute sets share names and level counts; premium and deductible
+# labels differ, so levels are matched by position within their own set. The
+# premium labels of the two sets are disjoint and decide which set a row uses.
+ATTRIBUTE_SETS = {"2 wheeler": get_attributes("2 wheeler"), "4 wheeler": get_attributes("4 wheeler")}
+ATTRIBUTES = storage.ATTRIBUTE_COLUMNS
+LEVELS = tuple(len(v) for v in ATTRIBUTE_SETS["4 wheeler"].values())
+N_PARAMS = sum(n - 1 for n in LEVELS)
+RESPONDENT_FIELDS = ["Vehicle Kind", "Ownership", "Vehicle Type", "Future_Vehicle_Type"]
+
+
+# (attribute set, attribute) -> {label: level index}
+LEVEL_LOOKUPS = {
+    (name, attr): {label: i for i, label in enumerate(attributes[attr])}
+    for name, attributes in ATTRIBUTE_SETS.items() for attr in ATTRIBUTES
+}
+PREMIUM_SETS = {label: name for name, attributes in ATTRIBUTE_SETS.items() for label in attributes["Annual Premium Price"]}
+
+
+def encode_levels(df):
+    """Level index per row and attribute (-1 where unknown), each row decoded in the set its premium belongs to"""
+    attribute_set = df["Annual Premium Price"].map(PREMIUM_SETS)
+    codes = np.full((len(df), len(ATTRIBUTES)), -1, dtype=np.int64)
+    for name in ATTRIBUTE_SETS:
+        rows = (attribute_set == name).to_numpy()
+        for i, attr in enumerate(ATTRIBUTES):
+            codes[rows, i] = df.loc[rows, attr].map(LEVEL_LOOKUPS[name, attr]).fillna(-1).to_numpy(dtype=np.int64)
+    return codes
+
+
+class ChoiceData:
+    """Compact choice sets: int8 level codes (n_sets, 3, n_attributes), chosen
+    alternative per set, and an index into the respondents table per set"""
+
+    def __init__(self, codes, choice, respondent, respondents):
+        self.codes = codes
+        self.choice = choice
+        self.respondent = respondent
+        self.respondents = respondents
+
+    def __len__(self):
+        return len(self.choice)
+
+    def subset(self, respondent_mask):
+        """Keep only the respondents where respondent_mask is True"""
+        keep = np.asarray(respondent_mask)[self.respondent]
+        remap = np.cumsum(respondent_mask) - 1
+        return ChoiceData(self.codes[keep], self.choice[keep], remap[self.respondent[keep]].astype(np.int32),
+                          self.respondents[np.asarray(respondent_mask)].reset_index(drop=True))
+
+
+def _encode_chunk(df):
+    df = df.copy()
+    df["Task"] = pd.to_numeric(df["Task"], errors="coerce")
+    df["Chosen"] = pd.to_numeric(df["Chosen"], errors="coerce").fillna(0).astype(np.int8)
+    codes = encode_levels(df)
+    known = (codes >= 0).all(axis=1) & df["Task"].notna().to_numpy()
+    df, codes = df[known], codes[known]
+
+    # Keep well-formed choice sets only: 3 profiles, exactly one chosen
+    order = np.lexsort((df["Profile"].to_numpy(), df["Task"].to_numpy(), df["Respondent id"].to_numpy()))
+    df, codes = df.iloc[order], codes[order]
+    set_id = df.groupby(["Respondent id", "Task"], sort=False).ngroup().to_numpy()
+    sizes = np.bincount(set_id)
+    chosen = np.bincount(set_id, weights=df["Chosen"].to_numpy())
+    valid = (sizes == N_ALTERNATIVES) & (chosen == 1)
+    rows = valid[set_id]
+    df, codes = df[rows], codes[rows]
+
+    n_sets = len(df) // N_ALTERNATIVES
+    codes = codes.reshape(n_sets, N_ALTERNATIVES, len(ATTRIBUTES)).astype(np.int8)
+    choice = df["Chosen"].to_numpy().reshape(n_sets, N_ALTERNATIVES).argmax(axis=1).astype(np.int8)
+    set_respondents = df["Respondent id"].to_numpy()[::N_ALTERNATIVES]
+
+    respondents = df.drop_duplicates("Respondent id").reindex(columns=["Respondent id", "Annual Premium Price"] + RESPONDENT_FIELDS)
+    respondents["Attribute Set"] = respondents.pop("Annual Premium Price").map(PREMIUM_SETS)
+    return codes, choice, set_respondents, respondents
+
+
+def load_choice_data(store=None, chunk_rows=100_000):
+    """Stream the response store into ChoiceData, holding one chunk of raw rows at a time"""
+    store = store or storage.get_store()
+    codes, choice, set_respondents, respondents = [], [], [], []
+    carry = None
+    for chunk in store.iter_responses(chunk_rows=chunk_rows):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        # A respondent's rows may straddle the chunk boundary; finish them next time
+        last = chunk["Respondent id"].iloc[-1]
+        tail = (chunk["Respondent id"] == last).to_numpy()
+        carry, chunk = chunk[tail], chunk[~tail]
+        for out, part in zip((codes, choice, set_respondents, respondents), _encode_chunk(chunk)):
+            out.append(part)
+    if carry is not None:
+        for out, part in zip((codes, choice, set_respondents, respondents), _encode_chunk(carry)):
+            out.append(part)
+
+    if not codes:
+        empty = pd.DataFrame(columns=["Respondent id"] + RESPONDENT_FIELDS + ["Attribute Set"])
+        return ChoiceData(np.empty((0, N_ALTERNATIVES, len(ATTRIBUTES)), np.int8), np.empty(0, np.int8), np.empty(0, np.int32), empty)
+    respondents = pd.concat(respondents, ignore_index=True).drop_duplicates("Respondent id").reset_index(drop=True)
+    index = pd.Index(respondents["Respondent id"])
+    return ChoiceData(np.concatenate(codes), np.concatenate(choice),
+                      index.get_indexer(np.concatenate(set_respondents)).astype(np.int32), respondents)
+
+# --------------------------- Aggregate MNL ---------------------------
+
+BATCH_SETS = 50_000
+
+
+def _batches(n):
+    for start in range(0, n, BATCH_SETS):
+        yield slice(start, min(start + BATCH_SETS, n))
+
+
+def mnl_loglik(beta, codes, choice, weights=None, hessian=True):
+    """Weighted log-likelihood, gradient and (optionally) Hessian, batched over choice sets"""
+    ll, grad = 0.0, np.zeros_like(beta)
+    hess = np.zeros((len(beta), len(beta))) if hessian else None
+    for batch in _batches(len(choice)):
+        X = effects_code(codes[batch], LEVELS)
+        u = X @ beta
+        u -= u.max(axis=1, keepdims=True)
+        p = np.exp(u)
+        p /= p.sum(axis=1, keepdims=True)
+        rows = np.arange(len(X))
+        w = np.ones(len(X)) if weights is None else weights[batch]
+        chosen = choice[batch]
+
+        ll += np.sum(w * np.log(p[rows, chosen]))
+        x_bar = np.einsum('na,nak->nk', p, X)
+        grad += w @ (X[rows, chosen] - x_bar)
+        if hessian:
+            K = X.shape[-1]
+            weighted = (X * (w[:, None] * p)[..., None]).reshape(-1, K)
+            hess -= weighted.T @ X.reshape(-1, K) - (x_bar * w[:, None]).T @ x_bar
+    return ll, grad, hess
+
+
+def fit_mnl(data, weights=None, max_iter=100, tol=1e-8):
+    """Newton-Raphson MNL fit; returns (beta, loglik, hessian)"""
+    beta = np.zeros(N_PARAMS)
+    ll, grad, hess = mnl_loglik(beta, data.codes, data.choice, weights)
+    for _ in range(max_iter):
+        step = np.linalg.solve(hess - 1e-9 * np.eye(N_PARAMS), -grad)
+        t = 1.0
+        while True:
+            new_ll, new_grad, new_hess = mnl_loglik(beta + t * step, data.codes, data.choice, weights)
+            if new_ll >= ll - 1e-12 or t < 1e-6:
+                break
+            t /= 2
+        beta = beta + t * step
+        converged = abs(new_ll - ll) < tol * (1 + abs(ll))
+        ll, grad, hess = new_ll, new_grad, new_hess
+        if converged:
+            break
+    return beta, ll, hess
+
+
+def expand_effects(beta):
+    """Effects-coded parameters -> one utility per level (last level = -sum of the others)"""
+    beta = np.asarray(beta)
+    out, start = [], 0
+    for n_levels in LEVELS:
+        block = beta[..., start:start + n_levels - 1]
+        out.append(np.concatenate([block, -block.sum(axis=-1, keepdims=True)], axis=-1))
+        start += n_levels - 1
+    return np.concatenate(out, axis=-1)
+
+
+def partworth_table(utilities, lower=None, upper=None):
+    rows = []
+    for attr in ATTRIBUTES:
+        for level in range(len(ATTRIBUTE_SETS["4 wheeler"][attr])):
+            labels = dict.fromkeys(a[attr][level] for a in ATTRIBUTE_SETS.values())
+            rows.append({"Attribute": attr, "Level": level, "Label": " / ".join(labels)})
+    table = pd.DataFrame(rows)
+    table["Utility"] = utilities
+    if lower is not None:
+        table["CI Lower"] = lower
+        table["CI Upper"] = upper
+    return table
+
+def utility_columns():
+    """Column names for per-level utilities, as written by fit_hb"""
+    return [f"{row.Attribute} | {row.Label}" for row in partworth_table(np.zeros(sum(LEVELS))).itertuples()]
+
+# --------------------------- Bootstrap ---------------------------
+
+_worker_data = None
+
+
+def _init_worker(codes, choice, respondent, n_respondents):
+    global _worker_data
+    _worker_data = ChoiceData(codes, choice, respondent, pd.DataFrame(index=range(n_respondents)))
+
+
+def _bootstrap_replicates(seeds):
+    data = _worker_data
+    n_respondents = len(data.respondents)
+    betas = []
+    for seed in seeds:
+        # Resample respondents with replacement, as per-set weights
+        counts = np.random.default_rng(seed).multinomial(n_respondents, np.full(n_respondents, 1 / n_respondents))
+        beta, _, _ = fit_mnl(data, weights=counts[data.respondent].astype(float))
+        betas.append(beta)
+    return betas
+
+
+def bootstrap_mnl(data, n_boot=200, workers=None, seed=0, level=0.95):
+    """Respondent-level bootstrap of the part-worths across a process pool; returns (lower, upper, draws)"""
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).generate_state(n_boot)
+    chunks = [c for c in np.array_split(seeds, workers) if len(c)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data.codes, data.choice, data.respondent, len(data.respondents))) as pool:
+        betas = [b for part in pool.map(_bootstrap_replicates, chunks) for b in part]
+    draws = expand_effects(np.array(betas))
+    alpha = (1 - level) / 2
+    return np.quantile(draws, alpha, axis=0), np.quantile(draws, 1 - alpha, axis=0), draws
+
+# --------------------------- Hierarchical Bayes MNL ---------------------------
+
+HB_ADAPT_EVERY = 50
+HB_TARGET_ACCEPTANCE = 0.3
+
+
+def _inv_wishart(df, scale, rng):
+    # Bartlett decomposition of Wishart(df, scale^-1), inverted
+    K = len(scale)
+    L = np.linalg.cholesky(np.linalg.inv(scale))
+    A = np.tril(rng.standard_normal((K, K)), -1)
+    A[np.diag_indices(K)] = np.sqrt(rng.chisquare(df - np.arange(K)))
+    LA = L @ A
+    return np.linalg.inv(LA @ LA.T)
+
+
+def _respondent_loglik(beta, X, choice, respondent, n_respondents):
+    u = np.einsum('nak,nk->na', X, beta[respondent])
+    u -= u.max(axis=1, keepdims=True)
+    ll = u[np.arange(len(u)), choice] - np.log(np.exp(u).sum(axis=1))
+    return np.bincount(respondent, weights=ll, minlength=n_respondents)
+
+
+def hb_fingerprint(data, iterations, burn_in):
+    """Identifies the data and settings a chain checkpoint belongs to"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([len(data.respondents), N_PARAMS, iterations, burn_in]).encode())
+    digest.update("\0".join(map(str, data.respondents["Respondent id"])).encode())
+    for array in (data.codes, data.choice, data.respondent):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def _hb_checkpoint_path(checkpoint_dir, chain):
+    return os.path.join(checkpoint_dir, f"hb_chain{chain}.npz") if checkpoint_dir else None
+
+
+def _save_hb_state(path, state):
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **{k: v for k, v in state.items() if k != "rng"},
+             rng=np.array(json.dumps(state["rng"].bit_generator.state)))
+    os.replace(tmp, path)
+
+
+def _load_hb_state(path):
+    with np.load(path) as saved:
+        state = {k: saved[k] for k in saved.files if k != "rng"}
+        rng = np.random.default_rng()
+        rng.bit_generator.state = json.loads(str(saved["rng"]))
+    state["rng"] = rng
+    state["iteration"] = int(state["iteration"])
+    state["fingerprint"] = str(state.get("fingerprint", ""))
+    return state
+
+
+def run_hb_chain(chain, iterations=2000, burn_in=1000, seed=0, checkpoint_dir=None, checkpoint_every=200, start=None,
+                 fingerprint=""):
+    """One Gibbs/Metropolis chain over all respondents at once
+
+    Returns (posterior mean utilities per respondent, mu draws after burn-in).
+    Chains start from `start` (e.g. the aggregate MNL estimate) and resume from
+    checkpoint_dir when a checkpoint for this chain exists and was written with
+    the same fingerprint (see hb_fingerprint); any other checkpoint is replaced.
+    """
+    data = _worker_data
+    N, K = len(data.respondents), N_PARAMS
+    X = effects_code(data.codes, LEVELS).astype(np.float32)
+    prior_df, prior_scale = K + 3, (K + 3) * np.eye(K)
+
+    path = _hb_checkpoint_path(checkpoint_dir, chain)
+    state = None
+    if path and os.path.exists(path):
+        state = _load_hb_state(path)
+        if fingerprint and state["fingerprint"] == fingerprint:
+            print(f"chain {chain}: resuming at iteration {state['iteration']}")
+        else:
+            print(f"chain {chain}: checkpoint {path} was written for other data or settings, starting fresh")
+            state = None
+    if state is None:
+        start = np.zeros(K) if start is None else np.asarray(start)
+        state = {
+            "iteration": 0,
+            "beta": np.tile(start, (N, 1)),
+            "mu": start.copy(),
+            "sigma": np.eye(K),
+            "step": np.full(N, 0.3),
+            "accepted": np.zeros(N),
+            "beta_sum": np.zeros((N, K)),
+            "mu_draws": np.zeros((max(iterations - burn_in, 0), K)),
+            "rng": np.random.default_rng([seed, chain]),
+            "fingerprint": fingerprint,
+        }
+    assert state["beta"].shape == (N, K), f"checkpoint has {state['beta'].shape} utilities, data needs {(N, K)}"
+    rng = state["rng"]
+    beta, mu, sigma, step = state["beta"], state["mu"], state["sigma"], state["step"]
+    ll = _respondent_loglik(beta, X, data.choice, data.respondent, N)
+
+    while state["iteration"] < iterations:
+        it = state["iteration"]
+
+        # Respondent-level utilities: random-walk Metropolis, all respondents in parallel
+        sigma_inv = np.linalg.inv(sigma)
+        chol = np.linalg.cholesky(sigma)
+        proposal = beta + step[:, None] * (rng.standard_normal((N, K)) @ chol.T)
+        new_ll = _respondent_loglik(proposal, X, data.choice, data.respondent, N)
+        d_old, d_new = beta - mu, proposal - mu
+        log_ratio = (new_ll - ll) - 0.5 * (np.einsum('nk,kl,nl->n', d_new, sigma_inv, d_new)
+                                          - np.einsum('nk,kl,nl->n', d_old, sigma_inv, d_old))
+        accept = np.log(rng.random(N)) < log_ratio
+        beta[accept], ll[accept] = proposal[accept], new_ll[accept]
+        state["accepted"] += accept
+
+        # Population mean and covariance
+        mu = rng.multivariate_normal(beta.mean(axis=0), sigma / N)
+        d = beta - mu
+        sigma = _inv_wishart(prior_df + N, prior_scale + d.T @ d, rng)
+
+        it += 1
+        if it <= burn_in and it % HB_ADAPT_EVERY == 0:
+            rate = state["accepted"] / HB_ADAPT_EVERY
+            step *= np.exp(rate - HB_TARGET_ACCEPTANCE)
+            state["accepted"][:] = 0
+        if it > burn_in:
+            state["beta_sum"] += beta
+            state["mu_draws"][it - burn_in - 1] = mu
+
+        state.update(iteration=it, beta=beta, mu=mu, sigma=sigma, step=step)
+        if path and (it % checkpoint_every == 0 or it == iterations):
+            _save_hb_state(path, state)
+
+    kept = max(iterations - burn_in, 1)
+    return expand_effects(state["beta_sum"] / kept), expand_effects(state["mu_draws"])
+
+
+def _run_hb_chain(args):
+    return run_hb_chain(*args)
+
+
+def fit_hb(data, chains=4, iterations=2000, burn_in=1000, seed=0, checkpoint_dir=None, workers=None):
+    """Run HB-MNL chains in a process pool; returns (individual utilities DataFrame, mu draws per chain)"""
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    start, _, _ = fit_mnl(data)
+    fingerprint = hb_fingerprint(data, iterations, burn_in)
+    jobs = [(chain, iterations, burn_in, seed, checkpoint_dir, 200, start, fingerprint) for chain in range(chains)]
+    with ProcessPoolExecutor(max_workers=workers or chains, initializer=_init_worker,
+                             initargs=(data.codes, data.choice, data.respondent, len(data.respondents))) as pool:
+        results = list(pool.map(_run_hb_chain, jobs))
+
+    individual = np.mean([r[0] for r in results], axis=0)
+    utilities = pd.concat([data.respondents.reset_index(drop=True), pd.DataFrame(individual, columns=utility_columns())], axis=1)
+    return utilities, [r[1] for r in results]
+
+
+def gelman_rubin(draws):
+    """R-hat per parameter from a list of (n_draws, n_params) chains"""
+    n = min(len(d) for d in draws)
+    chains = np.stack([d[-n:] for d in draws])
+    within = chains.var(axis=1, ddof=1).mean(axis=0)
+    between = n * chains.mean(axis=1).var(axis=0, ddof=1)
+    return np.sqrt(((n - 1) / n * within + between / n) / within)
+
+# --------------------------- Entry Point ---------------------------
+
+def _select(data, vehicle_class):
+    if vehicle_class:
+        data = data.subset((data.respondents["Attribute Set"] == vehicle_class).to_numpy())
+    return data
+
+
+def run_mnl(args):
+    data = _select(load_choice_data(chunk_rows=args.chunk_rows), args.vehicle_class)
+    print(f"{len(data.respondents)} respondents, {len(data)} choice sets")
+    beta, ll, hess = fit_mnl(data)
+    lower = upper = None
+    if args.bootstrap:
+        lower, upper, _ = bootstrap_mnl(data, args.bootstrap, args.workers)
+    print(f"log-likelihood {ll:.2f} (null {len(data) * np.log(1 / N_ALTERNATIVES):.2f})")
+    print(partworth_table(expand_effects(beta), lower, upper).to_string(index=False))
+
+
+def run_hb(args):
+    data = _select(load_choice_data(chunk_rows=args.chunk_rows), args.vehicle_class)
+    print(f"{len(data.respondents)} respondents, {len(data)} choice sets")
+    utilities, mu_draws = fit_hb(data, args.chains, args.iterations, args.burn_in,
+                                 checkpoint_dir=args.checkpoint_dir, workers=args.workers)
+    if len(mu_draws) > 1:
+        print(f"max R-hat of population means: {gelman_rubin(mu_draws).max():.3f}")
+    segments = utilities.groupby(["Attribute Set", "Vehicle Kind"], dropna=False)[utilities.columns[len(data.respondents.columns):]].mean()
+    print(segments.T.to_string())
+    if args.output:
+        utilities.to_csv(args.output, index=False)
+        print(f"Individual utilities written to {args.output}")
+
+
+COMMANDS = {
+    "hb": run_hb,
+    "mnl": run_mnl,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--vehicle-class", choices=sorted(ATTRIBUTE_SETS))
+    parser.add_argument("--bootstrap", type=int, default=0)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-rows", type=int, default=100_000)
+    parser.add_argument("--chains", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--burn-in", type=int, default=1000)
+    parser.add_argument("--checkpoint-dir")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    COMMANDS[args.command](args)
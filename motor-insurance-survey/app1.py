@@ -1,216 +1,165 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-from pyDOE2 import fullfact
 import datetime
+import secrets
 import uuid
-import json
 
-if 'respondent_id' not in st.session_state:
-    st.session_state.respondent_id = str(uuid.uuid4())
+from streamlit.runtime.scriptrunner import RerunException, StopException
 
-# --------------------------- Helper Functions ---------------------------
+import adaptive
+import aggregates
+import fieldwork
+import metrics
+import outbox
+import sessions
+import storage
+from design import N_ALTERNATIVES, PROFILE_LETTERS, generate_profile_codes, get_attribute_table
 
-def update_respondents_data():
-    import gspread
-    from oauth2client.service_account import ServiceAccountCredentials
+# --------------------------- Helper Functions ---------------------------
 
+def build_response_rows():
+    return storage.build_response_rows(
+        st.session_state.attribute_table.decode(st.session_state.profile_codes),
+        st.session_state.responses,
+        st.session_state.respondent_id,
+        st.session_state.demographics,
+        st.session_state.vehicle_info,
+    )
+
+def flush_submissions(rows_to_append, vehicle_kinds):
+    # Runs on the outbox flusher thread: persist, then fold into the dashboard counters
+    storage.get_store().append_rows(rows_to_append, vehicle_kinds)
     try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets["GOOGLE_SHEETS_CREDENTIALS"]), scope)
-        client = gspread.authorize(creds)
-        sheet = client.open_by_key("1OPhqnW0qoIMvsRdrzt2y-p1Wat-rJpiuKWINTi0cIjY")  # your sheet ID
-        respondents_sheet = sheet.worksheet("Respondents_Data")
-
-        # Fetch all data from the "Final_Responses" sheet
-        final_sheet = sheet.worksheet("Final_Responses")
-        all_data = final_sheet.get_all_records()
-
-        unique_respondents = {}
-        for row in all_data:
-            respondent_id = row.get("Respondent id", "")
-            vehicle_kind = row.get("Vehicle Kind", "") or row.get("Ownership", "")
-            if respondent_id and respondent_id not in unique_respondents:
-                unique_respondents[respondent_id] = vehicle_kind
-
-        total_respondents = len(unique_respondents)
-        private_vehicle_respondents = sum(1 for v in unique_respondents.values() if 'Private' in v or 'Own Vehicle' in v)
-        commercial_vehicle_respondents = sum(1 for v in unique_respondents.values() if 'Commercial' in v)
-        no_vehicle_respondents = total_respondents - private_vehicle_respondents - commercial_vehicle_respondents
-
-        # Update the Respondents_Data sheet
-        respondents_sheet.update(range_name='A2', values=[[total_respondents]])
-        respondents_sheet.update(range_name='B2', values=[[private_vehicle_respondents]])
-        respondents_sheet.update(range_name='C2', values=[[commercial_vehicle_respondents]])
-        respondents_sheet.update(range_name='D2', values=[[no_vehicle_respondents]])
-        
-        print("Respondents data successfully updated.")
-
+        fieldwork.record_submissions(rows_to_append)
     except Exception as e:
-        print(f"Error while updating Respondents_Data: {e}")
+        print(f"Error while updating fieldwork aggregates: {e}")
+
+@st.cache_data(ttl=30)
+def load_fieldwork():
+    return fieldwork.read_fieldwork()
 
+def assign_profiles(vehicle_type):
+    # Sessions hold level indices only; labels come from the shared attribute table
+    st.session_state.attribute_table, st.session_state.profile_codes = generate_profile_codes(vehicle_type)
+    st.session_state.profile_vehicle_type = vehicle_type
+    if st.session_state.adaptive:
+        st.session_state.utility_estimate = adaptive.new_estimate(st.session_state.attribute_table)
 
-def submit_to_google_sheets():
-    import gspread
-    from oauth2client.service_account import ServiceAccountCredentials
+def chosen_indices():
+    return [list(PROFILE_LETTERS).index(r["Choice"]) for r in st.session_state.responses]
 
+def respondent_id_from_url():
+    # ?rid= carries the respondent across reconnects and replicas; ignore anything but a UUID
     try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(st.secrets["GOOGLE_SHEETS_CREDENTIALS"]), scope)
-        client = gspread.authorize(creds)
-        sheet = client.open_by_key("1OPhqnW0qoIMvsRdrzt2y-p1Wat-rJpiuKWINTi0cIjY")  # your sheet ID
-        final_sheet = sheet.worksheet("Final_Responses")
-
-        df_profiles = st.session_state.df_profiles
-        responses = sorted(st.session_state.responses, key=lambda x: x["Task"])
-
-        rows_to_append = []
-
-        for response in responses:
-            task = response["Task"]
-            chosen_profile_letter = response["Choice"]
-
-            for profile_letter in ["A", "B", "C"]:
-                chosen = 1 if profile_letter == chosen_profile_letter else 0
-                profile = df_profiles[(df_profiles["Task"] == task) & (df_profiles["Profile"] == profile_letter)].iloc[0]
-
-                row = []
-
-                # Respondent ID, Task, Profile Letter
-                row.append(st.session_state.respondent_id)
-                row.append(task)
-                row.append(profile_letter)
-
-                # Add attribute values
-                for attr in st.session_state.attributes.keys():  # Use session state attributes
-                    row.append(profile[attr])
-
-                # Add choice flag
-                row.append(chosen)
-
-                # Add demographic and vehicle info
-                row.extend([st.session_state.demographics.get(k, "") for k in [
-                    "Age", "Gender", "Education", "Location", "Family Status", "Family Annual Income", "Top Add-ons"
-                ]])
-                
-                # Add all vehicle info fields
-                vehicle_fields = [
-                    "Ownership", "Vehicle Kind", "Vehicle Type", "Future_Vehicle_Type",
-                    "Vehicle Age", "Vehicle Cost", "Usage", "Driven By", "Insurance",
-                    "Trust Factor", "Business Type", "How many vehicles do you own?", 
-                    "Insurance Type"
-                ]
-                for field in vehicle_fields:
-                    row.append(st.session_state.vehicle_info.get(field, ""))
-
-                rows_to_append.append(row)
-
-        # Send all rows in one batch
-        final_sheet.append_rows(rows_to_append, value_input_option='USER_ENTERED')
-
-        print("Data successfully added to Google Sheets!")
-        update_respondents_data()
+        return str(uuid.UUID(st.query_params.get("rid", "")))
+    except ValueError:
+        return None
+
+def load_checkpoint():
+    # Only the current ?resume= token of an unfinished session resumes it; a
+    # forwarded or stale link starts a new respondent instead
+    respondent_id = respondent_id_from_url()
+    if respondent_id is None:
+        return None
+    try:
+        return sessions.load(respondent_id, st.query_params.get("resume", ""))
+    except Exception as e:
+        print(f"Error while loading session checkpoint: {e}")
+        return None
+
+def clear_resume_link():
+    for key in ("rid", "resume"):
+        if key in st.query_params:
+            del st.query_params[key]
+
+CHECKPOINT_KEYS = ["page", "responses", "demographics", "vehicle_info", "task_index", "profile_vehicle_type", "adaptive"]
+
+def checkpoint_session():
+    state = {key: st.session_state[key] for key in CHECKPOINT_KEYS}
+    codes = st.session_state.profile_codes
+    state["profile_codes"] = None if codes is None else codes.tolist()
+    # A fresh token per save, so a copied link stops resuming once this session moves on
+    token = secrets.token_urlsafe(16)
+    try:
+        if not sessions.save(st.session_state.respondent_id, state, token, st.session_state.resume_token):
+            # Another browser resumed this checkpoint from a copied link; keep
+            # the answers here but continue as a separate respondent
+            st.session_state.respondent_id = str(uuid.uuid4())
+            sessions.save(st.session_state.respondent_id, state, token)
+        st.session_state.resume_token = token
+        st.session_state.checkpoint = (state["page"], state["task_index"])
+        st.query_params["rid"] = st.session_state.respondent_id
+        st.query_params["resume"] = token
+    except Exception as e:
+        print(f"Error while checkpointing session: {e}")
 
+def finish_session():
+    # Called just before the submission is queued: claim the respondent id and
+    # drop the checkpoint, so a finished session is never resumed
+    try:
+        if not sessions.finish(st.session_state.respondent_id, st.session_state.resume_token):
+            # Another browser resumed this respondent from a copied link; submit as a separate one
+            st.session_state.respondent_id = str(uuid.uuid4())
     except Exception as e:
-        print(f"Error while submitting to Google Sheets: {e}")
-        st.error(f"Error submitting data: {str(e)}")
-
-# --------------------------- 1. Conjoint Setup ---------------------------
-
-def get_attributes(vehicle_type):
-    """Return different attribute levels based on vehicle type"""
-    if vehicle_type in ["2 wheeler", "EV 2 Wheeler"]:
-        return {
-            "Annual Premium Price": ["₹4,000", "₹5,000", "₹6,000", "₹8,000"],
-            "Voluntary Deductible": ["₹0", "₹500", "₹1,000", "₹1,500"],
-            "Key Coverage Feature": [
-                "Covers only repair costs",
-                "Daily compensation or transport if vehicle in repair",
-                "Emergency Roadside assistance",
-                "Support for theft/damage of belongings in vehicle",
-                "Medical expense coverage for vehicle occupants"
-            ],
-            "Spare parts used during repairs": [
-                "Only OEM (original) parts",
-                "Mix of OEM (original) & Non-OEM (aftermarket) parts",
-                "Non – OEM (aftermarket) parts",
-            ],
-            "Claims Experience": [
-                "Quick return of vehicle",
-                "Regular updates & transparency",
-                "Cashless claims at garage",
-                "Convenient pick-up and drop of vehicle",
-                "Repair at home for minor damages"
-            ]
-        }
-    else:  # For 4 wheelers, EVs, and commercial vehicles
-        return {
-            "Annual Premium Price": ["₹12,000", "₹15,000", "₹18,000", "₹20,000"],
-            "Voluntary Deductible": ["₹0", "₹1,000", "₹2,000", "₹5,000"],
-            "Key Coverage Feature": [
-                "Covers only repair costs",
-                "Daily compensation or transport if vehicle in repair",
-                "Emergency Roadside assistance",
-                "Support for theft/damage of belongings in vehicle",
-                "Medical expense coverage for vehicle occupants"
-            ],
-            "Spare parts used during repairs": [
-                "Only OEM (original) parts",
-                "Mix of OEM (original) & Non-OEM (aftermarket) parts",
-                "Non – OEM (aftermarket) parts",
-            ],
-            "Claims Experience": [
-                "Quick return of vehicle",
-                "Regular updates & transparency",
-                "Cashless claims at garage",
-                "Convenient pick-up and drop of vehicle",
-                "Repair at home for minor damages"
-            ]
-        }
-
-def generate_profiles(vehicle_type):
-    attributes = get_attributes(vehicle_type)
-    levels = [len(v) for v in attributes.values()]
-    factorial = fullfact(levels)
-    df_full = pd.DataFrame(factorial, columns=attributes.keys()).astype(int)
-
-    for attr in attributes:
-        df_full[attr] = df_full[attr].apply(lambda x: attributes[attr][x])
-
-    def sample_with_full_coverage(df_full, attributes, n_profiles=24, max_tries=100):
-        levels_needed = {attr: list(set(df_full[attr])) for attr in attributes.keys()}
-        
-        for attempt in range(max_tries):
-            df_sampled = df_full.sample(n=n_profiles).reset_index(drop=True)
-            full_coverage = True
-            for attr, levels in levels_needed.items():
-                observed_levels = df_sampled[attr].unique()
-                if not all(level in observed_levels for level in levels):
-                    full_coverage = False
-                    break
-            if full_coverage:
-                return df_sampled
-        return df_sampled  # fallback
-
-    df_sampled = sample_with_full_coverage(df_full, attributes)
-    df_sampled['Task'] = df_sampled.index // 3 + 1
-    df_sampled['Profile'] = df_sampled.groupby('Task').cumcount().apply(lambda x: chr(65 + x))
-    df_profiles = df_sampled[['Task', 'Profile'] + list(attributes.keys())]
-    return df_profiles
+        print(f"Error while deleting session checkpoint: {e}")
+    st.session_state.resume_token = None
+    st.session_state.checkpoint = ("thankyou", st.session_state.task_index)
+    clear_resume_link()
+
+def restore_session(state):
+    # Rebuild from the checkpoint without drawing a new design version
+    for key in CHECKPOINT_KEYS:
+        st.session_state[key] = state.get(key, st.session_state[key])
+    if state.get("profile_codes") is not None:
+        st.session_state.attribute_table = get_attribute_table(state["profile_vehicle_type"])
+        st.session_state.profile_codes = np.array(state["profile_codes"], dtype=np.int8)
+        if st.session_state.adaptive:
+            # Cheaper to replay a handful of answers than to checkpoint the estimate
+            st.session_state.utility_estimate = adaptive.replay(
+                st.session_state.attribute_table, st.session_state.profile_codes, chosen_indices())
+    st.session_state.resume_token = st.query_params.get("resume")
+    # Checkpoint again on this run so the link that resumed us stops working
+    st.session_state.checkpoint = None
 
 # --------------------------- 2. Streamlit App Setup ---------------------------
 
 st.set_page_config(page_title="Motor Insurance Preference Survey", layout="wide")
 
+# Drain queued submissions to the configured storage backend in the background
+outbox.start_flusher(flush_submissions)
+
+# Prometheus endpoint / structured metric logs, when configured
+metrics.start_reporting()
+
 # Initialize session state
 if "page" not in st.session_state:
-    st.session_state.page = "intro"
+    # ?view=dashboard opens the fieldwork dashboard instead of the survey
+    st.session_state.page = "dashboard" if st.query_params.get("view") == "dashboard" else "intro"
     st.session_state.responses = []
     st.session_state.demographics = {}
     st.session_state.vehicle_info = {}
     st.session_state.task_index = 0
-    st.session_state.df_profiles = None
-    st.session_state.attributes = None
+    st.session_state.profile_codes = None
+    st.session_state.attribute_table = None
+    st.session_state.profile_vehicle_type = None
+    st.session_state.adaptive = adaptive.ENABLED
+    st.session_state.utility_estimate = None
+    st.session_state.checkpoint = None
+    st.session_state.resume_token = None
+    st.session_state.profiled = metrics.sample_session()
+
+    state = load_checkpoint() if st.session_state.page != "dashboard" else None
+    if state:
+        st.session_state.respondent_id = respondent_id_from_url()
+        restore_session(state)
+    else:
+        st.session_state.respondent_id = str(uuid.uuid4())
+        clear_resume_link()
+
+# Checkpoint once per page transition (or survey task), not on every widget
+# rerun; visitors who never get past the intro leave nothing behind
+if st.session_state.page not in ("dashboard", "intro") and st.session_state.checkpoint != (st.session_state.page, st.session_state.task_index):
+    checkpoint_session()
 
 # --------------------------- 3. Page Functions ---------------------------
 
@@ -253,8 +202,7 @@ def future_vehicle():
             st.warning("Please select a vehicle type to proceed.")
         else:
             st.session_state.vehicle_info["Future_Vehicle_Type"] = future_vtype
-            st.session_state.attributes = get_attributes(future_vtype)
-            st.session_state.df_profiles = generate_profiles(future_vtype)
+            assign_profiles(future_vtype)
             st.session_state.page = "instructions"
             st.rerun()
 
@@ -290,8 +238,7 @@ Please provide details for the **latest vehicle you have purchased**.
                     "Insurance": insurance,
                     "Trust Factor": trust
                 })
-                st.session_state.attributes = get_attributes(vtype)
-                st.session_state.df_profiles = generate_profiles(vtype)
+                assign_profiles(vtype)
                 st.session_state.page = "instructions"
                 st.rerun()
 
@@ -317,8 +264,7 @@ Please provide details for the **latest vehicle you have purchased**.
                     "Trust Factor": trust
                 })
                 # Use 4-wheeler attributes for commercial vehicles
-                st.session_state.attributes = get_attributes("4 wheeler")
-                st.session_state.df_profiles = generate_profiles("4 wheeler")
+                assign_profiles("4 wheeler")
                 st.session_state.page = "instructions"
                 st.rerun()
 
@@ -348,24 +294,15 @@ def instructions():
         st.rerun()
 
 def survey():
-    df_profiles = st.session_state.df_profiles
     task_num = st.session_state.task_index + 1
 
     st.header(f"Task {task_num}")
 
-    task_df = df_profiles[df_profiles['Task'] == task_num].reset_index(drop=True)
-
     st.markdown("### Please compare the profiles below:")
 
-    # Build comparison table
-    comparison_data = {attr: [] for attr in st.session_state.attributes.keys()}
-    for attr in st.session_state.attributes.keys():
-        for _, row in task_df.iterrows():
-            comparison_data[attr].append(row[attr])
-
-    profile_labels = [f"Profile {p}" for p in task_df['Profile']]
-    comparison_df = pd.DataFrame.from_dict(comparison_data, orient='index', columns=profile_labels)
-    comparison_df.index.name = "Attribute"
+    # Comparison tables are decoded once per choice set and shared across sessions
+    comparison_df = st.session_state.attribute_table.comparison_table(st.session_state.profile_codes, task_num)
+    profile_labels = list(comparison_df.columns)
 
     st.table(comparison_df)
 
@@ -382,9 +319,13 @@ def survey():
                 "Task": task_num,
                 "Choice": choice[-1]
             })
+            if st.session_state.adaptive:
+                # Update this respondent's utilities and swap in the most informative next task
+                adaptive.next_task(st.session_state.attribute_table, st.session_state.profile_codes,
+                                   st.session_state.utility_estimate, task_num, chosen_indices()[-1])
             st.session_state.task_index += 1
 
-            if st.session_state.task_index >= st.session_state.df_profiles['Task'].nunique():
+            if st.session_state.task_index >= len(st.session_state.profile_codes) // N_ALTERNATIVES:
                 st.session_state.page = "demographics"
                 st.rerun()
             else:
@@ -400,27 +341,13 @@ def demographics():
         family_status = st.radio("Family Status:", ['Unmarried', 'Married', 'Married with children'], index = None)
         income = st.radio("Family Annual Income:", ['Less than ₹5 Lakhs', '₹5 Lakhs – ₹9.99 Lakhs', '₹10 Lakhs – ₹19.99 Lakhs', '₹20 Lakhs – ₹50 Lakhs', 'More than 50 Lakhs', 'Prefer not to say'], index = None)
         st.markdown("Choose your top 3 preferred insurance add-ons:")
-        addons = [
-            "Zero Depreciation Cover : Ensures that the insurance company will pay the full cost to repair or replace damaged parts of your car, without reducing the amount based on how old the parts are",
-            "Roadside Assistance : Emergency help if your car breaks down — towing, fuel delivery, flat tire fix, emergency hotel accommodation etc.",
-            "Engine Protection : Covers damage to the engine due to water ingress, oil leakage, etc. — not usually included in base policies",
-            "Personal Accident Cover (for Driver & Occupants) : Covers injuries or death of the driver and passengers in an accident",
-            "Consumables Cover : Covers small but essential items like engine oil, nuts & bolts, AC gas, etc., used during repairs",
-            "No Claim Bonus (NCB) Protection : Lets you keep your No Claim Bonus (a discount of 20% to 50% on your premium for not making claims) even if you file a claim during the policy year",
-            "Tyre Protection : Covers repair or replacement costs of tyres damaged by accidents, cuts, or bursts",
-            "Key Replacement : Covers the cost of replacing lost, stolen, or damaged car keys, including reprogramming if needed",
-            "Loss of personal belongings : Covers the loss or damage of personal items inside the car, such as electronics, bags, or valuables, due to theft or an accident",
-            "Battery Protection : Covers the cost of repairing or replacing your car's battery if it gets damaged due to electrical faults or accidents",
-            "Garage Cash : Provides a daily allowance to cover your transportation costs if your car is being repaired at a garage after an accident or breakdown",
-            "Misfueling : Covers the costs associated with repairing damage caused by putting the wrong type of fuel in a vehicle"
-        ]
         
         st.markdown(" ")
 
         selected_addons = []
         checkbox_states = {}
 
-        for addon in addons:
+        for addon in storage.ADDONS:
            checkbox_states[addon] = st.checkbox(addon, key=addon)
 
         # Count selected checkboxes
@@ -434,6 +361,7 @@ def demographics():
            if (not age or gender is None or education is None or location is None or family_status is None or income is None or len(selected_addons) != 3):
                 st.warning("Please fill in all the fields and exactly 3 add ons to continue.")
            else:
+               finish_session()
                st.session_state.demographics = {
                    "Respondent id": st.session_state.respondent_id,
                    "Age": age,
@@ -446,8 +374,10 @@ def demographics():
                }
                
                try:
-                   with st.spinner("Submitting your response..."):
-                       submit_to_google_sheets()
+                   # Durable local write; the flusher sends it to the storage backend
+                   outbox.enqueue(st.session_state.respondent_id,
+                                  aggregates.vehicle_kind_of(st.session_state.vehicle_info),
+                                  build_response_rows())
                    st.session_state.page = "thankyou"
                    st.rerun()
                except Exception as e:
@@ -457,6 +387,29 @@ def thankyou():
     st.title("Thank You!")
     st.markdown("""Thank you for taking the time to complete our survey. Your responses have been recorded successfully. We truly appreciate your input. Have a great day!""")
 
+def dashboard():
+    st.title("Fieldwork Dashboard")
+    data = load_fieldwork()
+    st.caption("Materialized counts, refreshed every 30 seconds.")
+
+    respondents = data["respondents"]
+    columns = st.columns(len(aggregates.COUNT_COLUMNS))
+    for column, bucket in zip(columns, aggregates.COUNT_COLUMNS):
+        column.metric(bucket, int(respondents.get(bucket, 0)))
+
+    for metric in ["vehicle_type", "location", "income", "addon"]:
+        st.subheader(fieldwork.METRICS[metric])
+        if data[metric].empty:
+            st.write("No responses yet.")
+        else:
+            st.bar_chart(data[metric])
+
+    st.subheader("Choice rate by attribute level")
+    if not data["level_shown"].empty:
+        st.dataframe(fieldwork.level_choice_rates(data))
+    else:
+        st.write("No responses yet.")
+
 # --------------------------- 4. Page Navigation ---------------------------
 
 page_dict = {
@@ -467,8 +420,12 @@ page_dict = {
     "instructions": instructions,
     "survey": survey,
     "demographics": demographics,
-    "thankyou": thankyou
+    "thankyou": thankyou,
+    "dashboard": dashboard
 }
 
-# Render current page
-page_dict[st.session_state.page]()
\ No newline at end of file
+# Render current page; st.rerun() and st.stop() are navigation, not errors
+page = st.session_state.page
+with metrics.timed("survey_page_render", ignore=(RerunException, StopException), page=page), \
+        metrics.profiled(st.session_state.profiled, f"{st.session_state.respondent_id}-{page}"):
+    page_dict[page]()
@@ -0,0 +1,268 @@
+"""Offline microbenchmarks for the survey app.
+
+Run with: python bench.py <benchmark> [options]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from pyDOE2 import fullfact
+
+import design
+import storage
+
+# --------------------------- Helpers ---------------------------
+
+def _timeit(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000  # ms
+
+
+def _report(name, timings):
+    print(f"{name:<28} mean {timings.mean():8.3f} ms   p50 {np.percentile(timings, 50):8.3f} ms   "
+          f"p95 {np.percentile(timings, 95):8.3f} ms")
+
+# --------------------------- Profile Generation ---------------------------
+
+def _legacy_sample_with_full_coverage(df_full, attributes, n_profiles=24, max_tries=100):
+    levels_needed = {attr: list(set(df_full[attr])) for attr in attributes.keys()}
+
+    for attempt in range(max_tries):
+        df_sampled = df_full.sample(n=n_profiles).reset_index(drop=True)
+        full_coverage = True
+        for attr, levels in levels_needed.items():
+            observed_levels = df_sampled[attr].unique()
+            if not all(level in observed_levels for level in levels):
+                full_coverage = False
+                break
+        if full_coverage:
+            return df_sampled
+    return df_sampled  # fallback
+
+
+def _legacy_generate_profiles(vehicle_type):
+    # Pre-cache implementation, kept here as the baseline
+    attributes = design.get_attributes(vehicle_type)
+    levels = [len(v) for v in attributes.values()]
+    factorial = fullfact(levels)
+    df_full = pd.DataFrame(factorial, columns=attributes.keys()).astype(int)
+
+    for attr in attributes:
+        df_full[attr] = df_full[attr].apply(lambda x: attributes[attr][x])
+
+    df_sampled = _legacy_sample_with_full_coverage(df_full, attributes)
+    df_sampled['Task'] = df_sampled.index // 3 + 1
+    df_sampled['Profile'] = df_sampled.groupby('Task').cumcount().apply(lambda x: chr(65 + x))
+    return df_sampled[['Task', 'Profile'] + list(attributes.keys())]
+
+
+def bench_profiles(args):
+    for vehicle_type in ["2 wheeler", "4 wheeler"]:
+        print(f"-- {vehicle_type}")
+        _report("before (rebuild per call)", _timeit(lambda: _legacy_generate_profiles(vehicle_type), args.repeat))
+        design.generate_profiles(vehicle_type)  # warm the design cache
+        _report("after (design pool)", _timeit(lambda: design.generate_profiles(vehicle_type), args.repeat))
+
+
+def bench_design(args):
+    for vehicle_type in ["2 wheeler", "4 wheeler"]:
+        attributes = design.get_attributes(vehicle_type)
+        levels = [len(v) for v in attributes.values()]
+        start = time.perf_counter()
+        versions, stats = design.get_design_pool(attributes, n_versions=args.versions, seed=0)
+        elapsed = time.perf_counter() - start
+        print(f"-- {vehicle_type}: {len(versions)} versions built in {elapsed:.2f} s")
+        print(stats.describe().loc[["mean", "min", "max"]].to_string())
+
+        # D-error of the previous rejection sampler, for comparison
+        codes, df_full = design.get_design(attributes)
+        legacy = []
+        for _ in range(args.versions):
+            sampled = _legacy_sample_with_full_coverage(df_full, attributes)
+            legacy.append(design.d_error(np.column_stack([sampled[a].cat.codes for a in attributes]), levels))
+        legacy = np.array(legacy)
+        finite = legacy[np.isfinite(legacy)]
+        print(f"legacy rejection sampler: median d_error {np.median(finite):.3f}, "
+              f"{(~np.isfinite(legacy)).sum()} of {len(legacy)} samples singular")
+
+# --------------------------- Row Assembly ---------------------------
+
+def _legacy_build_rows(df_profiles, responses, respondent_id, demographics, vehicle_info):
+    # Per-cell implementation from before the indexed join, kept as the baseline
+    rows = []
+    for response in sorted(responses, key=lambda x: x["Task"]):
+        for profile_letter in ["A", "B", "C"]:
+            profile = df_profiles[(df_profiles["Task"] == response["Task"]) & (df_profiles["Profile"] == profile_letter)].iloc[0]
+            row = [respondent_id, response["Task"], profile_letter]
+            row.extend(profile[attr] for attr in storage.ATTRIBUTE_COLUMNS)
+            row.append(1 if profile_letter == response["Choice"] else 0)
+            row.extend(demographics.get(k, "") for k in storage.DEMOGRAPHIC_FIELDS)
+            row.extend(vehicle_info.get(k, "") for k in storage.VEHICLE_FIELDS)
+            rows.append(row)
+    return rows
+
+
+def bench_rows(args):
+    rng = np.random.default_rng(0)
+    df_profiles = design.generate_profiles("4 wheeler")
+    responses = [{"Task": t, "Choice": rng.choice(list("ABC"))} for t in range(1, 9)]
+    session = (df_profiles, responses, "respondent", {"Age": "30"}, {"Ownership": "No Vehicle"})
+    _report("before (per-cell loops)", _timeit(lambda: _legacy_build_rows(*session), args.repeat))
+    _report("after (indexed join)", _timeit(lambda: storage.build_response_rows(*session), args.repeat))
+
+    # Bulk re-export of many respondents in one join
+    n = args.respondents
+    ids = np.repeat([f"r{i}" for i in range(n)], 24)
+    profiles = pd.concat([df_profiles] * n, ignore_index=True).assign(**{"Respondent id": ids})
+    choices = pd.DataFrame({"Respondent id": np.repeat([f"r{i}" for i in range(n)], 8),
+                            "Task": np.tile(np.arange(1, 9), n),
+                            "Choice": rng.choice(list("ABC"), 8 * n)})
+    respondents = pd.DataFrame({"Respondent id": [f"r{i}" for i in range(n)], "Age": "30"})
+    _report(f"bulk export ({n} respondents)", _timeit(lambda: storage.build_response_frame(profiles, choices, respondents), 5))
+
+# --------------------------- Page Rendering ---------------------------
+
+def _legacy_comparison_table(df_profiles, attributes, task_num):
+    # What survey() rebuilt on every rerun before the tables were precomputed
+    task_df = df_profiles[df_profiles['Task'] == task_num].reset_index(drop=True)
+    comparison_data = {attr: [] for attr in attributes.keys()}
+    for attr in attributes.keys():
+        for _, row in task_df.iterrows():
+            comparison_data[attr].append(row[attr])
+    profile_labels = [f"Profile {p}" for p in task_df['Profile']]
+    comparison_df = pd.DataFrame.from_dict(comparison_data, orient='index', columns=profile_labels)
+    comparison_df.index.name = "Attribute"
+    return comparison_df
+
+
+def _app_test():
+    from streamlit.testing.v1 import AppTest
+
+    os.environ.setdefault("SURVEY_OUTBOX_PATH", os.path.join(tempfile.mkdtemp(), "outbox.sqlite3"))
+    return AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app1.py"), default_timeout=60)
+
+
+def bench_render(args):
+    attributes = design.get_attributes("4 wheeler")
+    df_profiles = design.generate_profiles("4 wheeler")
+    _report("table build before (iterrows)", _timeit(lambda: _legacy_comparison_table(df_profiles, attributes, 1), args.repeat))
+    table, codes = design.generate_profile_codes("4 wheeler")
+    _report("table lookup after", _timeit(lambda: table.comparison_table(codes, 1), args.repeat))
+
+    # Full script reruns of a task page, as Streamlit does on every widget interaction
+    at = _app_test().run()
+    at.button[0].click().run()
+    at.radio[0].set_value("No").run()
+    at.button[0].click().run()
+    at.radio[0].set_value("4 wheeler").run()
+    at.button[0].click().run()
+    at.button[0].click().run()
+    _report("survey page rerun", _timeit(at.run, min(args.repeat, 50)))
+
+# --------------------------- Session Memory ---------------------------
+
+def _session_bytes(make_session, n):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = [make_session() for _ in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del sessions
+    return total / n
+
+
+def bench_memory(args):
+    n = args.sessions
+    design.generate_profile_codes("4 wheeler")  # shared tables and design pool are per process, not per session
+
+    def legacy_session():
+        # df_profiles of label strings plus a private copy of the attributes dict
+        return {"df_profiles": _legacy_generate_profiles("4 wheeler"), "attributes": design.get_attributes("4 wheeler")}
+
+    def compact_session():
+        table, codes = design.generate_profile_codes("4 wheeler")
+        return {"attribute_table": table, "profile_codes": codes}
+
+    print(f"{n} simulated sessions")
+    print(f"before (DataFrame + attributes) {_session_bytes(legacy_session, n):10.0f} bytes/session")
+    print(f"after (int8 codes + shared table) {_session_bytes(compact_session, n):8.0f} bytes/session")
+
+# --------------------------- Market Simulator ---------------------------
+
+def bench_simulator(args):
+    from analysis import LEVELS
+    from simulator import MarketSimulator
+
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    simulator = MarketSimulator(rng.normal(size=(args.respondents, sum(LEVELS))))
+    print(f"{args.respondents} respondents: utility matrix built in {time.perf_counter() - start:.2f} s")
+    scenarios = rng.integers(0, 1200, size=(args.repeat, 3))
+    _report("scenario (uncached)", _timeit(lambda: simulator.evaluate_batch(scenarios[:1]), args.repeat))
+    simulator.evaluate(scenarios[0].tolist())
+    _report("scenario (cached)", _timeit(lambda: simulator.evaluate(scenarios[0].tolist()), args.repeat))
+    _report(f"batch of {len(scenarios)} scenarios", _timeit(lambda: simulator.evaluate_batch(scenarios), 5))
+
+# --------------------------- Adaptive Tasks ---------------------------
+
+def bench_adaptive(args):
+    import adaptive
+
+    # Simulated respondents with random part-worths answer fixed vs adaptive tasks
+    rng = np.random.default_rng(0)
+    attributes = design.get_attributes("4 wheeler")
+    table = design.get_attribute_table("4 wheeler")
+    versions, _ = design.get_design_pool(attributes)
+    timings, errors = [], {"fixed": [], "adaptive": []}
+    for _ in range(args.sessions):
+        beta = rng.normal(size=sum(table.levels) - len(table.levels))
+        for mode in errors:
+            codes = versions[rng.integers(len(versions))].copy()
+            estimate = adaptive.new_estimate(table)
+            for task in range(1, design.N_TASKS + 1):
+                X = design.effects_code(codes[(task - 1) * 3:task * 3], table.levels)
+                chosen = int(np.argmax(X @ beta + rng.gumbel(size=3)))
+                if mode == "adaptive":
+                    start = time.perf_counter()
+                    adaptive.next_task(table, codes, estimate, task, chosen)
+                    timings.append(time.perf_counter() - start)
+                else:
+                    estimate.update(X, chosen)
+            errors[mode].append(np.sqrt(np.mean((estimate.mean - beta) ** 2)))
+    _report("next task (update + select)", np.array(timings) * 1000)
+    print(f"p99 {np.percentile(timings, 99) * 1000:.3f} ms")
+    for mode, rmse in errors.items():
+        print(f"{mode:<9} part-worth RMSE after {design.N_TASKS} tasks: {np.mean(rmse):.3f}")
+
+# --------------------------- Entry Point ---------------------------
+
+BENCHMARKS = {
+    "adaptive": bench_adaptive,
+    "design": bench_design,
+    "memory": bench_memory,
+    "profiles": bench_profiles,
+    "render": bench_render,
+    "rows": bench_rows,
+    "simulator": bench_simulator,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--respondents", type=int, default=10000)
+    parser.add_argument("--versions", type=int, default=design.N_VERSIONS)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,282 @@
+import functools
+import threading
+
+import numpy as np
+import pandas as pd
+from pyDOE2 import fullfact
+
+import metrics
+
+# --------------------------- Attribute Levels ---------------------------
+
+def get_attributes(vehicle_type):
+    """Return different attribute levels based on vehicle type"""
+    if vehicle_type in ["2 wheeler", "EV 2 Wheeler"]:
+        return {
+            "Annual Premium Price": ["₹4,000", "₹5,000", "₹6,000", "₹8,000"],
+            "Voluntary Deductible": ["₹0", "₹500", "₹1,000", "₹1,500"],
+            "Key Coverage Feature": [
+                "Covers only repair costs",
+                "Daily compensation or transport if vehicle in repair",
+                "Emergency Roadside assistance",
+                "Support for theft/damage of belongings in vehicle",
+                "Medical expense coverage for vehicle occupants"
+            ],
+            "Spare parts used during repairs": [
+                "Only OEM (original) parts",
+                "Mix of OEM (original) & Non-OEM (aftermarket) parts",
+                "Non – OEM (aftermarket) parts",
+            ],
+            "Claims Experience": [
+                "Quick return of vehicle",
+                "Regular updates & transparency",
+                "Cashless claims at garage",
+                "Convenient pick-up and drop of vehicle",
+                "Repair at home for minor damages"
+            ]
+        }
+    else:  # For 4 wheelers, EVs, and commercial vehicles
+        return {
+            "Annual Premium Price": ["₹12,000", "₹15,000", "₹18,000", "₹20,000"],
+            "Voluntary Deductible": ["₹0", "₹1,000", "₹2,000", "₹5,000"],
+            "Key Coverage Feature": [
+                "Covers only repair costs",
+                "Daily compensation or transport if vehicle in repair",
+                "Emergency Roadside assistance",
+                "Support for theft/damage of belongings in vehicle",
+                "Medical expense coverage for vehicle occupants"
+            ],
+            "Spare parts used during repairs": [
+                "Only OEM (original) parts",
+                "Mix of OEM (original) & Non-OEM (aftermarket) parts",
+                "Non – OEM (aftermarket) parts",
+            ],
+            "Claims Experience": [
+                "Quick return of vehicle",
+                "Regular updates & transparency",
+                "Cashless claims at garage",
+                "Convenient pick-up and drop of vehicle",
+                "Repair at home for minor damages"
+            ]
+        }
+
+# --------------------------- Full-Factorial Design Cache ---------------------------
+
+# One entry per distinct attribute set (2-wheeler / everything else), shared by
+# every session in the process.
+_design_cache = {}
+_design_lock = threading.Lock()
+
+
+def attributes_key(attributes):
+    return tuple((attr, tuple(levels)) for attr, levels in attributes.items())
+
+
+def get_design(attributes):
+    """Return the cached (codes, df_full) full factorial for an attribute set"""
+    key = attributes_key(attributes)
+    design = _design_cache.get(key)
+    if design is None:
+        with _design_lock:
+            design = _design_cache.get(key)
+            if design is None:
+                design = _build_design(attributes)
+                _design_cache[key] = design
+    return design
+
+
+def _build_design(attributes):
+    levels = [len(v) for v in attributes.values()]
+    codes = fullfact(levels).astype(np.int8)
+    codes.flags.writeable = False
+
+    # Integer level -> label lookup, one categorical per column
+    df_full = pd.DataFrame({
+        attr: pd.Categorical.from_codes(codes[:, i], categories=attributes[attr])
+        for i, attr in enumerate(attributes)
+    })
+    return codes, df_full
+
+# --------------------------- Balanced Design Engine ---------------------------
+
+N_TASKS = 8
+N_ALTERNATIVES = 3
+N_VERSIONS = 300
+CANDIDATES_PER_VERSION = 64
+
+
+def effects_code(codes, levels):
+    """Effects-code level indices (rows x attributes) into a rows x sum(L - 1) matrix"""
+    codes = np.asarray(codes)
+    blocks = []
+    for i, n_levels in enumerate(levels):
+        block = np.eye(n_levels)[codes[..., i]][..., :-1]
+        block[codes[..., i] == n_levels - 1] = -1.0
+        blocks.append(block)
+    return np.concatenate(blocks, axis=-1)
+
+
+def d_errors(versions, levels):
+    """MNL D-error at zero utilities, det(I^-1)^(1/K), for a stack of (n, 24, n_attributes) versions"""
+    X = effects_code(versions, levels).reshape(len(versions), N_TASKS, N_ALTERNATIVES, -1)
+    Xc = X - X.mean(axis=2, keepdims=True)
+    info = np.einsum('ntak,ntal->nkl', Xc, Xc) / N_ALTERNATIVES
+    sign, logdet = np.linalg.slogdet(info)
+    return np.where(sign > 0, np.exp(-logdet / info.shape[-1]), np.inf)
+
+
+def d_error(version, levels):
+    return float(d_errors(np.asarray(version)[None], levels)[0])
+
+
+def _balanced_versions(levels, rng, n):
+    """n random level-balanced, zero-overlap versions as an int8 (n, 24, n_attributes) array"""
+    n_rows = N_TASKS * N_ALTERNATIVES
+    versions = np.empty((n, N_TASKS, N_ALTERNATIVES, len(levels)), dtype=np.int8)
+    rows = np.arange(n_rows)
+    for i, n_levels in enumerate(levels):
+        # Sorted, balanced level multiset dealt round-robin across tasks: a level
+        # occurs at most ceil(24 / L) <= 8 times in a row, so no task ever sees
+        # it twice (zero overlap for L >= 3).
+        relabel = rng.permuted(np.tile(np.arange(n_levels), (n, 1)), axis=1)
+        column = relabel[:, np.sort(rows % n_levels)]
+        dealt = column.reshape(n, N_ALTERNATIVES, N_TASKS).transpose(0, 2, 1)
+        task_order = rng.permuted(np.tile(np.arange(N_TASKS), (n, 1)), axis=1)
+        dealt = np.take_along_axis(dealt, task_order[:, :, None], axis=1)
+        versions[..., i] = rng.permuted(dealt, axis=2)
+    return versions.reshape(n, n_rows, len(levels))
+
+
+def make_version(levels, rng, candidates=CANDIDATES_PER_VERSION):
+    """Build one level-balanced, minimal-overlap 8 x 3 design, keeping the most D-efficient candidate"""
+    versions = _balanced_versions(levels, rng, candidates)
+    errors = d_errors(versions, levels)
+    for i in np.argsort(errors):
+        if len(np.unique(versions[i], axis=0)) == len(versions[i]):
+            return versions[i]
+    # Practically unreachable with dozens of candidates; keep going, but say so
+    print(f"Warning: no candidate without repeated profiles in {candidates}; using the most D-efficient one")
+    return versions[np.argmin(errors)]
+
+
+def design_stats(version, levels):
+    tasks = version.reshape(N_TASKS, N_ALTERNATIVES, -1)
+    balance = []
+    overlap = 0
+    for i, n_levels in enumerate(levels):
+        counts = np.bincount(version[:, i], minlength=n_levels)
+        balance.append(counts.min() / counts.max())
+        # Repeated levels inside a choice set, beyond what the level count forces
+        distinct = np.array([len(np.unique(t[:, i])) for t in tasks])
+        overlap += int((min(n_levels, N_ALTERNATIVES) - distinct).sum())
+    return {
+        "d_error": d_error(version, levels),
+        "min_level_balance": float(min(balance)),
+        "overlap": overlap,
+    }
+
+
+_pool_cache = {}
+
+
+def get_design_pool(attributes, n_versions=N_VERSIONS, seed=None):
+    """Return the cached (versions, stats) pool for an attribute set
+
+    versions is an int8 array of shape (n_versions, 24, n_attributes) holding
+    level indices; stats is a DataFrame with one row of diagnostics per version.
+    """
+    key = (attributes_key(attributes), n_versions)
+    pool = _pool_cache.get(key)
+    if pool is None:
+        with _design_lock:
+            pool = _pool_cache.get(key)
+            if pool is None:
+                levels = [len(v) for v in attributes.values()]
+                rng = np.random.default_rng(seed)
+                versions = np.stack([make_version(levels, rng) for _ in range(n_versions)])
+                versions.flags.writeable = False
+                stats = pd.DataFrame([design_stats(v, levels) for v in versions])
+                stats.index.name = "Version"
+                pool = versions, stats
+                _pool_cache[key] = pool
+    return pool
+
+# --------------------------- Shared Attribute Tables ---------------------------
+
+PROFILE_LETTERS = np.array(["A", "B", "C"])
+
+
+class AttributeTable:
+    """Immutable attribute names and level labels, shared by every session using them
+
+    Sessions keep only an int8 (24, n_attributes) array of level indices and
+    decode it through this table when rendering or exporting.
+    """
+
+    def __init__(self, attributes):
+        self.key = attributes_key(attributes)
+        self.names = tuple(attributes)
+        self.levels = tuple(len(v) for v in attributes.values())
+        self._labels = []
+        for values in attributes.values():
+            labels = np.array(values, dtype=object)
+            labels.flags.writeable = False
+            self._labels.append(labels)
+
+    def as_dict(self):
+        return {name: list(labels) for name, labels in zip(self.names, self._labels)}
+
+    def decode(self, codes):
+        """Expand level indices into the Task / Profile / attribute DataFrame"""
+        n = len(codes)
+        df_profiles = pd.DataFrame({
+            'Task': np.arange(n) // N_ALTERNATIVES + 1,
+            'Profile': PROFILE_LETTERS[np.arange(n) % N_ALTERNATIVES],
+        })
+        for i, name in enumerate(self.names):
+            df_profiles[name] = pd.Categorical.from_codes(codes[:, i], categories=self._labels[i])
+        return df_profiles
+
+    def comparison_table(self, codes, task_num):
+        """Attribute x profile table for one task, shared across sessions showing the same choice set"""
+        start = (task_num - 1) * N_ALTERNATIVES
+        return _comparison_table(self, codes[start:start + N_ALTERNATIVES].tobytes())
+
+
+@functools.lru_cache(maxsize=4096)
+def _comparison_table(table, block):
+    codes = np.frombuffer(block, dtype=np.int8).reshape(N_ALTERNATIVES, len(table.names))
+    values = [labels[codes[:, i]] for i, labels in enumerate(table._labels)]
+    comparison_df = pd.DataFrame(values, index=list(table.names),
+                                 columns=[f"Profile {p}" for p in PROFILE_LETTERS[:N_ALTERNATIVES]])
+    comparison_df.index.name = "Attribute"
+    return comparison_df
+
+
+_table_cache = {}
+
+
+def get_attribute_table(vehicle_type):
+    attributes = get_attributes(vehicle_type)
+    key = attributes_key(attributes)
+    table = _table_cache.get(key)
+    if table is None:
+        table = _table_cache.setdefault(key, AttributeTable(attributes))
+    return table
+
+# --------------------------- Profile Generation ---------------------------
+
+_rng = np.random.default_rng()
+
+
+@metrics.timed("survey_generate_profiles")
+def generate_profile_codes(vehicle_type):
+    """Return (attribute_table, codes) for a new respondent, codes being an int8 (24, n_attributes) array"""
+    table = get_attribute_table(vehicle_type)
+    versions, _ = get_design_pool(get_attributes(vehicle_type))
+    return table, versions[_rng.integers(len(versions))].copy()
+
+
+def generate_profiles(vehicle_type):
+    table, codes = generate_profile_codes(vehicle_type)
+    return table.decode(codes)
@@ -0,0 +1,191 @@
+"""Incremental columnar export of responses to Parquet or Arrow IPC.
+
+Every attribute, demographic and vehicle column is dictionary-encoded and
+"Top Add-ons" becomes a 12-bit multi-hot mask. A watermark file remembers how
+far which storage backend has been exported, so each run only appends new
+respondents, one part file per chunk read. Parquet parts are zstd-compressed;
+uncompressed Arrow IPC parts (--format arrow) are larger but are memory-mapped
+by read_export without decoding or copying.
+
+Run with: python export.py --output export/ [--format arrow] [--chunk-rows 100000]
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+WATERMARK_FILE = "_watermark.json"
+PART_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+ADDON_MASK_COLUMN = "Top Add-ons Mask"
+CATEGORICAL_COLUMNS = ["Profile"] + storage.ATTRIBUTE_COLUMNS + [
+    c for c in storage.DEMOGRAPHIC_FIELDS + storage.VEHICLE_FIELDS if c != "Top Add-ons"
+]
+EXPORT_COLUMNS = (["Respondent id", "Task", "Profile"] + storage.ATTRIBUTE_COLUMNS + ["Chosen"]
+                  + [c for c in CATEGORICAL_COLUMNS if c not in ["Profile"] + storage.ATTRIBUTE_COLUMNS]
+                  + [ADDON_MASK_COLUMN])
+
+# --------------------------- Encoding ---------------------------
+
+def export_schema():
+    """One fixed Arrow schema for every part
+
+    pandas picks int8 or int16 category codes depending on how many values a
+    batch has, so dictionary columns are pinned to int32 indices; otherwise
+    parts written from small and large batches cannot be concatenated.
+    """
+    import pyarrow as pa
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    fields = {"Respondent id": dictionary, "Task": pa.int8(), "Chosen": pa.int8(), ADDON_MASK_COLUMN: pa.uint16()}
+    fields.update({column: dictionary for column in CATEGORICAL_COLUMNS})
+    return pa.schema([(column, fields[column]) for column in EXPORT_COLUMNS])
+
+
+def addon_mask(top_addons):
+    """Multi-hot uint16 mask with bit i set when storage.ADDONS[i] was picked
+
+    Add-on texts contain commas themselves, so the joined string is matched
+    against the known add-ons rather than split.
+    """
+    top_addons = pd.Series(top_addons, dtype=object).fillna("").astype(str)
+    mask = np.zeros(len(top_addons), dtype=np.uint16)
+    for bit, addon in enumerate(storage.ADDONS):
+        mask |= top_addons.str.contains(addon, regex=False).to_numpy().astype(np.uint16) << bit
+    return mask
+
+
+def decode_addons(mask):
+    return [addon for bit, addon in enumerate(storage.ADDONS) if int(mask) >> bit & 1]
+
+
+def encode_responses(df):
+    """Raw RESPONSE_COLUMNS rows -> compact typed frame ready for Parquet"""
+    out = pd.DataFrame({
+        "Respondent id": df["Respondent id"].astype(str).astype("category"),
+        "Task": pd.to_numeric(df["Task"], errors="coerce").astype("int8"),
+        "Chosen": pd.to_numeric(df["Chosen"], errors="coerce").fillna(0).astype("int8"),
+        ADDON_MASK_COLUMN: addon_mask(df["Top Add-ons"]),
+    })
+    for column in CATEGORICAL_COLUMNS:
+        out[column] = df[column].fillna("").astype(str).astype("category")
+    return out[EXPORT_COLUMNS]
+
+# --------------------------- Incremental Export ---------------------------
+
+def read_watermark(output):
+    path = os.path.join(output, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {"cursor": 0, "respondents": 0, "parts": 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_watermark(output, watermark):
+    path = os.path.join(output, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _write_part(table, path, part_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if part_format == "parquet":
+        pq.write_table(table, path + ".tmp", compression="zstd", use_dictionary=True)
+    else:
+        with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+
+def export_responses(output, store=None, chunk_rows=100_000, part_format="parquet"):
+    """Append respondents added since the last run; returns the number exported
+
+    Reads chunk_rows rows at a time and writes each chunk as its own part,
+    moving the watermark after every part, so memory stays bounded and an
+    interrupted run resumes at the last finished part.
+    """
+    import pyarrow as pa
+
+    store = store or storage.get_store()
+    os.makedirs(output, exist_ok=True)
+    watermark = read_watermark(output)
+    # The cursor is only meaningful for the store and format that wrote it
+    for key, current in (("source", store.source), ("format", part_format)):
+        if watermark.get(key, current) != current:
+            raise ValueError(f"{output} was exported with {key} {watermark[key]!r}, not {current!r}; "
+                             f"export to a new directory instead")
+
+    exported = 0
+    while True:
+        df, cursor = store.read_responses(watermark["cursor"], limit=chunk_rows)
+        if df.empty:
+            return exported
+
+        table = pa.Table.from_pandas(encode_responses(df), schema=export_schema(), preserve_index=False)
+        _write_part(table, os.path.join(output, f"part-{watermark['parts']:06d}{PART_FORMATS[part_format]}"), part_format)
+
+        # A respondent split across chunks counts once, in the chunk where they start
+        respondents = df["Respondent id"].astype(str)
+        new = respondents.nunique() - int(respondents.iloc[0] == watermark.get("last_respondent"))
+        watermark = {
+            "source": store.source,
+            "format": part_format,
+            "cursor": cursor,
+            "respondents": watermark["respondents"] + new,
+            "parts": watermark["parts"] + 1,
+            "last_respondent": respondents.iloc[-1],
+            "exported_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        _write_watermark(output, watermark)
+        exported += new
+
+
+def _read_part(path, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path.endswith(PART_FORMATS["arrow"]):
+        # Uncompressed IPC: columns are views into the memory-mapped file
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        return table if columns is None else table.select(columns)
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+
+def read_export(output, columns=None):
+    """Arrow table over every exported part
+
+    Dictionary columns stay encoded; table.column(name).chunks[i].indices
+    gives the level codes. Arrow IPC parts are read zero-copy. Only parts
+    written before the schema was pinned are cast to it.
+    """
+    import pyarrow as pa
+
+    parts = sorted(p for suffix in PART_FORMATS.values() for p in glob.glob(os.path.join(output, f"part-*{suffix}")))
+    if not parts:
+        raise FileNotFoundError(f"No exported responses in {output}")
+    schema = export_schema()
+    if columns is not None:
+        schema = pa.schema([schema.field(c) for c in columns])
+    tables = []
+    for path in parts:
+        table = _read_part(path, columns)
+        tables.append(table if table.schema.equals(schema) else table.cast(schema))
+    return pa.concat_tables(tables)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="export")
+    parser.add_argument("--format", choices=sorted(PART_FORMATS), default="parquet")
+    parser.add_argument("--chunk-rows", type=int, default=100_000)
+    args = parser.parse_args()
+    n = export_responses(args.output, chunk_rows=args.chunk_rows, part_format=args.format)
+    print(f"Exported {n} new respondents to {args.output}")
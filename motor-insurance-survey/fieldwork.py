@@ -0,0 +1,99 @@
+import collections
+import os
+
+import pandas as pd
+
+import aggregates
+import localdb
+import storage
+from export import addon_mask
+
+# --------------------------- Materialized Fieldwork Aggregates ---------------------------
+
+# Counters updated from each flushed batch, so the dashboard never scans raw
+# responses. One row per (metric, key).
+AGGREGATES_PATH = os.environ.get("SURVEY_AGGREGATES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "survey_aggregates.sqlite3"))
+
+METRICS = {
+    "respondents": "Respondents",
+    "vehicle_type": "Vehicle type",
+    "location": "Location",
+    "income": "Family annual income",
+    "addon": "Add-on picks",
+    "level_shown": "Times shown",
+    "level_chosen": "Times chosen",
+}
+
+_column = {name: i for i, name in enumerate(storage.RESPONSE_COLUMNS)}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    metric TEXT NOT NULL,
+    key TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (metric, key)
+);
+"""
+
+
+def _connect(path=None):
+    return localdb.connect(path or AGGREGATES_PATH, SCHEMA)
+
+
+def _increments(rows):
+    counts = collections.Counter()
+    seen = set()
+    for row in rows:
+        for attr in storage.ATTRIBUTE_COLUMNS:
+            key = f"{attr} | {row[_column[attr]]}"
+            counts["level_shown", key] += 1
+            if str(row[_column["Chosen"]]) == "1":
+                counts["level_chosen", key] += 1
+
+        respondent_id = row[_column["Respondent id"]]
+        if respondent_id in seen:
+            continue
+        seen.add(respondent_id)
+        vehicle_kind = row[_column["Vehicle Kind"]] or row[_column["Ownership"]]
+        counts["respondents", "Total"] += 1
+        counts["respondents", aggregates.respondent_bucket(vehicle_kind)] += 1
+        vehicle_type = row[_column["Vehicle Type"]] or row[_column["Future_Vehicle_Type"]] or "Not recorded"
+        counts["vehicle_type", f"{aggregates.respondent_bucket(vehicle_kind)} | {vehicle_type}"] += 1
+        counts["location", row[_column["Location"]] or "Not recorded"] += 1
+        counts["income", row[_column["Family Annual Income"]] or "Not recorded"] += 1
+        mask = int(addon_mask([row[_column["Top Add-ons"]]])[0])
+        for bit, addon in enumerate(storage.ADDONS):
+            if mask >> bit & 1:
+                counts["addon", addon.split(" : ")[0]] += 1
+    return counts
+
+
+def record_submissions(rows, path=None):
+    """Fold a batch of RESPONSE_COLUMNS rows into the counters in one transaction"""
+    counts = _increments(rows)
+    conn = _connect(path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO counters (metric, key, n) VALUES (?, ?, ?) ON CONFLICT(metric, key) DO UPDATE SET n = n + excluded.n",
+            [(metric, key, n) for (metric, key), n in counts.items()],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def read_fieldwork(path=None):
+    """Return {metric: Series of counts by key} straight from the counters table"""
+    rows = _connect(path).execute("SELECT metric, key, n FROM counters").fetchall()
+    df = pd.DataFrame(rows, columns=["metric", "key", "n"])
+    return {metric: df[df["metric"] == metric].set_index("key")["n"].sort_index() for metric in METRICS}
+
+
+def level_choice_rates(fieldwork):
+    shown, chosen = fieldwork["level_shown"], fieldwork["level_chosen"]
+    table = pd.DataFrame({"Shown": shown, "Chosen": chosen.reindex(shown.index, fill_value=0)})
+    table["Choice rate"] = table["Chosen"] / table["Shown"]
+    table.index = pd.MultiIndex.from_tuples([tuple(k.split(" | ", 1)) for k in table.index], names=["Attribute", "Level"])
+    return table
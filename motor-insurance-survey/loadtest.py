@@ -0,0 +1,196 @@
+"""Headless load test: N virtual respondents walk the survey concurrently.
+
+Each respondent is a Streamlit AppTest session driven through intro ->
+vehicle_ownership -> vehicle_type/future_vehicle -> instructions -> 8 survey
+tasks -> demographics -> thankyou with random answers. AppTest sessions share
+Streamlit's global runtime, so concurrency comes from a pool of worker
+processes, each running one respondent at a time against a throwaway local
+SQLite storage backend. Results are written as JSON.
+
+Run with: python loadtest.py --respondents 50 --concurrency 10 --output results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app1.py")
+MAX_STEPS = 100
+
+# --------------------------- Virtual Respondent ---------------------------
+
+def _fill_widgets(at, rng):
+    """Answer every unanswered widget on the page; returns True if anything changed"""
+    changed = False
+    for radio in at.radio:
+        if radio.value is None:
+            radio.set_value(rng.choice(radio.options))
+            changed = True
+    for text_input in at.text_input:
+        if not text_input.value:
+            text_input.input(str(rng.randint(1, 60)))
+            changed = True
+    if at.checkbox and not any(c.value for c in at.checkbox):
+        for checkbox in rng.sample(list(at.checkbox), 3):
+            checkbox.check()
+        changed = True
+    return changed
+
+
+def run_respondent(seed, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    timings = []  # (page, ms) for every script run
+
+    def run(at, page):
+        start = time.perf_counter()
+        at.run()
+        timings.append((page, (time.perf_counter() - start) * 1000))
+        if at.exception:
+            raise RuntimeError(f"{page}: {at.exception[0].message}")
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    run(at, "intro")
+    for _ in range(MAX_STEPS):
+        page = at.session_state["page"]
+        if page == "thankyou":
+            break
+        if _fill_widgets(at, rng) and page == "vehicle_type":
+            # The vehicle kind radio reveals the rest of the form
+            run(at, page)
+            _fill_widgets(at, rng)
+        at.button[0].click()
+        run(at, page)
+    else:
+        raise RuntimeError(f"respondent {seed} did not finish (stuck on {at.session_state['page']})")
+
+    return timings, _session_bytes(at.session_state.to_dict())
+
+
+def _session_bytes(state):
+    import design
+
+    # Deep size of everything the session owns; shared attribute tables are per process
+    seen = set()
+
+    def size(obj):
+        if id(obj) in seen or isinstance(obj, (design.AttributeTable, type)) or callable(obj):
+            return 0
+        seen.add(id(obj))
+        total = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            total += sum(size(k) + size(v) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set)):
+            total += sum(size(v) for v in obj)
+        return total
+
+    return size(state)
+
+# --------------------------- Driver ---------------------------
+
+def _percentiles(values):
+    values = np.asarray(values)
+    return {
+        "count": int(len(values)),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def _warm_worker():
+    # Process start-up costs (imports, design pools) are not per-respondent latency
+    from streamlit.testing.v1 import AppTest  # noqa: F401
+    import design
+
+    for vehicle_type in ["2 wheeler", "4 wheeler"]:
+        design.get_design_pool(design.get_attributes(vehicle_type))
+
+
+def _respondent(seed, timeout):
+    try:
+        timings, state_bytes = run_respondent(seed, timeout)
+    except Exception as e:
+        return None, None, f"{type(e).__name__}: {e}"
+    return timings, state_bytes, None
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="survey-loadtest-")
+    os.environ["SURVEY_STORAGE"] = "sqlite"
+    os.environ["SURVEY_STORAGE_PATH"] = os.path.join(workdir, "responses.sqlite3")
+    os.environ["SURVEY_OUTBOX_PATH"] = os.path.join(workdir, "outbox.sqlite3")
+    os.environ["SURVEY_AGGREGATES_PATH"] = os.path.join(workdir, "aggregates.sqlite3")
+    os.environ["SURVEY_SESSIONS_PATH"] = os.path.join(workdir, "sessions.sqlite3")
+    import outbox
+    import storage
+
+    page_timings = {}
+    session_bytes = []
+    errors = []
+
+    # AppTest rebinds __main__ to the app script, so workers must find
+    # _respondent by module name rather than through __main__
+    import loadtest
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.concurrency, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=loadtest._warm_worker) as pool:
+        seeds = range(args.seed, args.seed + args.respondents)
+        for timings, state_bytes, error in pool.map(loadtest._respondent, seeds, [args.timeout] * len(seeds)):
+            if error:
+                errors.append(error)
+                continue
+            for page, ms in timings:
+                page_timings.setdefault(page, []).append(ms)
+            session_bytes.append(state_bytes)
+    elapsed = time.perf_counter() - start
+
+    # Drain whatever the background flusher has not sent yet
+    flush_start = time.perf_counter()
+    drained = 0
+    while outbox.pending_count():
+        drained += outbox.flush_once(lambda rows, kinds: storage.get_store().append_rows(rows, kinds))
+    flush_elapsed = time.perf_counter() - flush_start
+
+    completed = len(session_bytes)
+    result = {
+        "respondents": args.respondents,
+        "concurrency": args.concurrency,
+        "completed": completed,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        # Whole page walks finished per second, not the speed of the submit step itself
+        "completion_rate_per_s": completed / elapsed if elapsed else 0.0,
+        "final_drain_s": flush_elapsed,
+        "final_drain_respondents": drained,
+        "stored_respondents": storage.get_store().read_aggregates()["Total"],
+        "pages": {page: _percentiles(ms) for page, ms in sorted(page_timings.items())},
+        "session_state_bytes_mean": float(np.mean(session_bytes)) if session_bytes else None,
+        "workdir": workdir,
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--respondents", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,26 @@
+import sqlite3
+import threading
+
+# --------------------------- Local SQLite Files ---------------------------
+
+_local = threading.local()
+
+
+def connect(path, schema, pragmas=()):
+    """Per-thread autocommit WAL connection to path, creating schema on first use
+
+    sqlite3 connections must not be shared across threads, so each thread
+    keeps one connection per file.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        for pragma in pragmas:
+            conn.execute(f"PRAGMA {pragma}")
+        conn.executescript(schema)
+        conns[path] = conn
+    return conn
@@ -0,0 +1,195 @@
+import bisect
+import contextlib
+import cProfile
+import http.server
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+# --------------------------- In-process Metrics ---------------------------
+
+# Per-process counters and latency histograms. Every Streamlit process keeps
+# its own; scrape or log each replica and sum them downstream.
+METRICS_PORT = os.environ.get("SURVEY_METRICS_PORT")
+METRICS_LOG_INTERVAL = float(os.environ.get("SURVEY_METRICS_LOG_INTERVAL", "0"))
+PROFILE_FRACTION = float(os.environ.get("SURVEY_PROFILE_FRACTION", "0"))
+PROFILE_DIR = os.environ.get("SURVEY_PROFILE_DIR", "profiles")
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count], sum
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+        entry[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        entry[1] += seconds
+
+
+@contextlib.contextmanager
+def timed(name, ignore=(), **labels):
+    """Record the duration of the block in <name>_seconds and failures in <name>_errors_total
+
+    Exceptions listed in ignore (e.g. Streamlit's rerun signal) are control
+    flow, not errors. Also usable as a decorator.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except ignore:
+        raise
+    except Exception:
+        increment(f"{name}_errors_total", **labels)
+        raise
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot():
+    """Plain-dict copy of every counter and histogram, for logging or tests"""
+    with _lock:
+        counters = [(name, dict(labels), value) for (name, labels), value in _counters.items()]
+        histograms = [(name, dict(labels), list(buckets), total) for (name, labels), (buckets, total) in _histograms.items()]
+    return {
+        "counters": [{"name": name, "labels": labels, "value": value} for name, labels, value in sorted(counters, key=str)],
+        "histograms": [
+            {"name": name, "labels": labels, "count": sum(buckets), "sum": total,
+             "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], buckets))}
+            for name, labels, buckets, total in sorted(histograms, key=str)
+        ],
+    }
+
+# --------------------------- Exposition ---------------------------
+
+def _labels_text(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    escaped = {k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+def render_prometheus():
+    """Prometheus text exposition format (version 0.0.4)"""
+    data = snapshot()
+    lines = []
+    typed = set()
+    for counter in data["counters"]:
+        if counter["name"] not in typed:
+            lines.append(f"# TYPE {counter['name']} counter")
+            typed.add(counter["name"])
+        lines.append(f"{counter['name']}{_labels_text(counter['labels'])} {counter['value']}")
+    for hist in data["histograms"]:
+        name = hist["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for le, n in hist["buckets"].items():
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels_text(hist['labels'], le=le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels_text(hist['labels'])} {hist['sum']:.6f}")
+        lines.append(f"{name}_count{_labels_text(hist['labels'])} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the app log
+
+
+def _log_loop(interval):
+    while True:
+        time.sleep(interval)
+        print(json.dumps({"event": "survey_metrics", "ts": time.time(), "pid": os.getpid(), **snapshot()}))
+
+
+_reporters = {}
+_reporters_lock = threading.Lock()
+
+
+def start_reporting(port=METRICS_PORT, log_interval=METRICS_LOG_INTERVAL):
+    """Start the /metrics endpoint and/or the structured log thread once per process
+
+    Both are off unless SURVEY_METRICS_PORT or SURVEY_METRICS_LOG_INTERVAL is set.
+    """
+    with _reporters_lock:
+        if port and "http" not in _reporters:
+            try:
+                server = http.server.ThreadingHTTPServer(("", int(port)), _MetricsHandler)
+            except OSError as e:
+                # Another replica on this host already owns the port
+                print(f"Error while starting metrics endpoint on port {port}: {e}")
+                server = None
+            if server is not None:
+                threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            _reporters["http"] = server
+        if log_interval and "log" not in _reporters:
+            _reporters["log"] = threading.Thread(target=_log_loop, args=(log_interval,), name="metrics-log", daemon=True)
+            _reporters["log"].start()
+
+# --------------------------- Sampled Profiling ---------------------------
+
+def sample_session(fraction=PROFILE_FRACTION):
+    """Decide once per session whether its script runs are profiled"""
+    return fraction > 0 and random.random() < fraction
+
+
+@contextlib.contextmanager
+def profiled(enabled, name):
+    """cProfile the block and dump it to PROFILE_DIR/<name>-<id>.prof when enabled"""
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can be active at a time on newer Pythons
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}-{uuid.uuid4().hex[:8]}.prof"))
+        except OSError as e:
+            print(f"Error while writing profile: {e}")
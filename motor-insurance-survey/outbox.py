@@ -0,0 +1,241 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import localdb
+import metrics
+
+# --------------------------- Local Write-Ahead Log ---------------------------
+
+# Submissions land here first; a background thread drains them to the sink
+# (Google Sheets) so respondents never wait on network calls.
+OUTBOX_PATH = os.environ.get("SURVEY_OUTBOX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "survey_outbox.sqlite3"))
+
+FLUSH_INTERVAL = 5.0       # seconds between drains when the sink is healthy
+MAX_BATCH_RESPONDENTS = 200
+CLAIM_LEASE = 120.0        # seconds before another process may retry a claimed batch
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+QUOTA_BACKOFF = 60.0       # Sheets quotas are per minute
+MAX_BATCH_ATTEMPTS = 3     # failed batches after which entries are retried one at a time
+
+_worker_id = str(uuid.uuid4())
+_flushers = {}  # outbox path -> flusher thread
+_flusher_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    respondent_id TEXT NOT NULL,
+    vehicle_kind TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+
+-- Submissions the sink rejected on their own; kept for inspection and requeue_dead
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    respondent_id TEXT NOT NULL,
+    vehicle_kind TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+def _connect(path=None):
+    return localdb.connect(path or OUTBOX_PATH, SCHEMA, pragmas=["synchronous=FULL"])
+
+
+def enqueue(respondent_id, vehicle_kind, rows, path=None):
+    """Durably record one respondent's rows; returns once the local commit is done"""
+    _connect(path).execute(
+        "INSERT INTO pending (respondent_id, vehicle_kind, rows, created_at) VALUES (?, ?, ?, ?)",
+        (respondent_id, vehicle_kind, json.dumps(rows, ensure_ascii=False), time.time()),
+    )
+
+
+def pending_count(path=None):
+    return _connect(path).execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+
+def _claim_batch(conn):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM pending WHERE claimed_by IS NULL OR claimed_at < ? ORDER BY id LIMIT ?",
+            (now - CLAIM_LEASE, MAX_BATCH_RESPONDENTS),
+        )]
+        if ids:
+            marks = ",".join("?" * len(ids))
+            conn.execute(f"UPDATE pending SET claimed_by = ?, claimed_at = ?, attempts = attempts + 1 WHERE id IN ({marks})",
+                         [_worker_id, now, *ids])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if not ids:
+        return []
+    marks = ",".join("?" * len(ids))
+    return conn.execute(f"SELECT id, vehicle_kind, rows, attempts FROM pending WHERE id IN ({marks}) ORDER BY id", ids).fetchall()
+
+
+def _release(conn, ids):
+    marks = ",".join("?" * len(ids))
+    conn.execute(f"UPDATE pending SET claimed_by = NULL, claimed_at = NULL WHERE id IN ({marks})", ids)
+
+
+def _bury(conn, entry_id, error):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "INSERT INTO dead_letter (id, respondent_id, vehicle_kind, rows, created_at, attempts, error, failed_at) "
+            "SELECT id, respondent_id, vehicle_kind, rows, created_at, attempts, ?, ? FROM pending WHERE id = ?",
+            (f"{type(error).__name__}: {error}", time.time(), entry_id),
+        )
+        conn.execute("DELETE FROM pending WHERE id = ?", (entry_id,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    metrics.increment("survey_outbox_dead_letter_total")
+
+
+def _flush_individually(conn, batch, sink):
+    """Send entries one by one; dead-letter those the sink rejects while others go through
+
+    An entry is only blamed when another entry of the same pass succeeded.
+    If every entry fails, the sink itself is broken (missing worksheet,
+    credentials or configuration): the batch is released and the first error
+    propagates so the caller backs off.
+    """
+    flushed, rejected, retry_error = 0, [], None
+    for position, (entry_id, vehicle_kind, rows, _) in enumerate(batch):
+        try:
+            sink(json.loads(rows), [vehicle_kind])
+        except Exception as e:
+            if is_retryable(e):
+                retry_error = e
+                break
+            rejected.append((entry_id, e))
+            continue
+        conn.execute("DELETE FROM pending WHERE id = ?", (entry_id,))
+        flushed += 1
+    if not flushed:
+        _release(conn, [b[0] for b in batch])
+        raise retry_error or rejected[0][1]
+    if retry_error is not None:
+        _release(conn, [b[0] for b in batch[position:]])
+    for entry_id, error in rejected:
+        print(f"Error while flushing queued response {entry_id}, moved to dead letters: {error}")
+        _bury(conn, entry_id, error)
+    return flushed
+
+
+def flush_once(sink, path=None):
+    """Send every claimable pending submission to sink(rows, vehicle_kinds) in one call
+
+    Returns the number of respondents flushed. A retryable failure (quota,
+    server or transport error) releases the claim and propagates so the caller
+    can back off. Any other failure, or a batch that has already failed
+    MAX_BATCH_ATTEMPTS times, is retried one entry at a time so a single bad
+    submission ends up in dead_letter instead of blocking the rest; when no
+    entry gets through, nothing is dead-lettered and the error propagates.
+    """
+    conn = _connect(path)
+    batch = _claim_batch(conn)
+    if not batch:
+        return 0
+    ids = [b[0] for b in batch]
+    try:
+        sink([row for b in batch for row in json.loads(b[2])], [b[1] for b in batch])
+    except Exception as e:
+        if is_retryable(e) and max(b[3] for b in batch) < MAX_BATCH_ATTEMPTS:
+            _release(conn, ids)
+            raise
+        return _flush_individually(conn, batch, sink)
+    marks = ",".join("?" * len(ids))
+    conn.execute(f"DELETE FROM pending WHERE id IN ({marks})", ids)
+    return len(ids)
+
+
+def dead_letter_count(path=None):
+    return _connect(path).execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+
+def requeue_dead(path=None):
+    """Move every dead-lettered submission back to pending (e.g. after fixing the sink); returns how many"""
+    conn = _connect(path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        n = conn.execute(
+            "INSERT INTO pending (respondent_id, vehicle_kind, rows, created_at) "
+            "SELECT respondent_id, vehicle_kind, rows, created_at FROM dead_letter ORDER BY id"
+        ).rowcount
+        conn.execute("DELETE FROM dead_letter")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return n
+
+# --------------------------- Background Flusher ---------------------------
+
+def _status_code(e):
+    return getattr(getattr(e, "response", None), "status_code", None)
+
+
+def _is_quota_error(e):
+    return _status_code(e) == 429
+
+
+def is_retryable(e):
+    """Quota, server, auth and transport errors are worth retrying; anything else is the payload's fault"""
+    status = _status_code(e)
+    if status is not None:
+        return status in (401, 403, 408, 429) or status >= 500
+    # requests' exceptions subclass OSError; sqlite3 reports a locked database as OperationalError
+    return isinstance(e, (OSError, sqlite3.OperationalError))
+
+
+def _flush_loop(sink, path):
+    failures = 0
+    while True:
+        try:
+            flushed = flush_once(sink, path)
+            failures = 0
+            if flushed:
+                print(f"Flushed {flushed} queued responses.")
+                continue  # drain any backlog before sleeping
+            delay = FLUSH_INTERVAL
+        except Exception as e:
+            failures += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** failures)
+            if _is_quota_error(e):
+                delay = max(delay, QUOTA_BACKOFF)
+            delay *= random.uniform(0.5, 1.0)
+            print(f"Error while flushing queued responses (retry in {delay:.0f}s): {e}")
+        time.sleep(delay)
+
+
+def start_flusher(sink, path=None):
+    """Start the per-process flusher thread of the outbox at path once; later calls are no-ops"""
+    path = path or OUTBOX_PATH
+    with _flusher_lock:
+        flusher = _flushers.get(path)
+        if flusher is None or not flusher.is_alive():
+            flusher = threading.Thread(target=_flush_loop, args=(sink, path), name=f"outbox-flusher-{os.path.basename(path)}", daemon=True)
+            flusher.start()
+            _flushers[path] = flusher
+    return flusher
@@ -0,0 +1,101 @@
+import hmac
+import json
+import os
+import time
+
+import localdb
+
+# --------------------------- Session Checkpoints ---------------------------
+
+# One row per respondent, rewritten at every page transition. Any process
+# sharing this file can pick a respondent up where they left off, given the
+# respondent's current resume token. Each save replaces the token, so a resume
+# link stops working once the session moves on. Checkpoints are deleted once a
+# submission is queued and expire after SESSION_TTL, so this never becomes a
+# second copy of the response data.
+SESSIONS_PATH = os.environ.get("SURVEY_SESSIONS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "survey_sessions.sqlite3"))
+SESSION_TTL = float(os.environ.get("SURVEY_SESSION_TTL", 7 * 24 * 3600))  # seconds
+PRUNE_INTERVAL = 3600.0  # seconds between prunes per process
+
+_last_prune = 0.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    respondent_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def _connect(path=None):
+    return localdb.connect(path or SESSIONS_PATH, SCHEMA)
+
+
+def save(respondent_id, state, token, previous_token=None, path=None):
+    """Replace the checkpoint of respondent_id with state, a JSON-serializable dict, under a new resume token
+
+    Returns False without writing when the stored checkpoint no longer carries
+    previous_token, i.e. another browser session resumed it in the meantime.
+    """
+    global _last_prune
+    now = time.time()
+    conn = _connect(path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT state FROM sessions WHERE respondent_id = ?", (respondent_id,)).fetchone()
+        if row is not None and not hmac.compare_digest(json.loads(row[0]).get("resume_token", ""), previous_token or ""):
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute(
+            "INSERT INTO sessions (respondent_id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(respondent_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (respondent_id, json.dumps({**state, "resume_token": token}, ensure_ascii=False), now),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if now - _last_prune > PRUNE_INTERVAL:
+        _last_prune = now
+        prune(path=path)
+    return True
+
+
+def load(respondent_id, token, path=None):
+    """Return the last unexpired checkpoint of respondent_id if token is its current resume token, else None"""
+    row = _connect(path).execute("SELECT state FROM sessions WHERE respondent_id = ? AND updated_at >= ?",
+                                 (respondent_id, time.time() - SESSION_TTL)).fetchone()
+    if row is None:
+        return None
+    state = json.loads(row[0])
+    if not token or not hmac.compare_digest(state.pop("resume_token", ""), token):
+        return None
+    return state
+
+
+def finish(respondent_id, token, path=None):
+    """Delete the checkpoint of a submitted session
+
+    Returns False, leaving the checkpoint alone, when it no longer carries
+    token, i.e. another browser session resumed it and now owns the id.
+    """
+    conn = _connect(path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT state FROM sessions WHERE respondent_id = ?", (respondent_id,)).fetchone()
+        if row is not None and not hmac.compare_digest(json.loads(row[0]).get("resume_token", ""), token or ""):
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute("DELETE FROM sessions WHERE respondent_id = ?", (respondent_id,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+def prune(older_than=SESSION_TTL, path=None):
+    """Delete checkpoints not updated in the last older_than seconds; returns how many"""
+    return _connect(path).execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - older_than,)).rowcount
+
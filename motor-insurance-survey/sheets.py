@@ -0,0 +1,103 @@
+import json
+import threading
+
+import metrics
+
+# --------------------------- Google Sheets Client Pool ---------------------------
+
+SHEET_ID = "1OPhqnW0qoIMvsRdrzt2y-p1Wat-rJpiuKWINTi0cIjY"  # your sheet ID
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+
+def _credentials_from_secrets():
+    import streamlit as st
+    return json.loads(st.secrets["GOOGLE_SHEETS_CREDENTIALS"])
+
+
+class SheetsPool:
+    """Process-wide, lazily authorized gspread client with cached worksheet handles
+
+    gspread converts the credentials to google-auth. Its session refreshes the
+    access token before any request made within a few minutes of expiry, so the
+    pool only reconnects after auth or transport errors.
+    """
+
+    def __init__(self, sheet_id=SHEET_ID, credentials_loader=_credentials_from_secrets):
+        self.sheet_id = sheet_id
+        self.credentials_loader = credentials_loader
+        self._lock = threading.RLock()
+        self._sheet = None
+        self._worksheets = {}
+        self.stats = {"handshakes": 0, "handshakes_avoided": 0, "reconnects": 0}
+
+    def _connect(self):
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(self.credentials_loader(), SCOPE)
+        client = gspread.authorize(creds)
+        self._sheet = client.open_by_key(self.sheet_id)
+        self._worksheets = {}
+        self.stats["handshakes"] += 1
+        metrics.increment("survey_sheets_handshakes_total")
+        metrics.increment("survey_sheets_quota_requests_total", request="read")  # open_by_key
+
+    def reset(self):
+        with self._lock:
+            self._sheet = None
+            self._worksheets = {}
+
+    def worksheet(self, name):
+        with self._lock:
+            if self._sheet is None:
+                self._connect()
+            ws = self._worksheets.get(name)
+            if ws is None:
+                ws = self._worksheets[name] = self._sheet.worksheet(name)
+                metrics.increment("survey_sheets_quota_requests_total", request="read")
+            return ws
+
+    def _request(self, name, op, request):
+        # Each op is one Sheets API request; quotas are per minute, split into reads and writes
+        metrics.increment("survey_sheets_quota_requests_total", request=request)
+        try:
+            with metrics.timed("survey_sheets_call", worksheet=name, request=request):
+                return op(self.worksheet(name))
+        except Exception as e:
+            if getattr(getattr(e, "response", None), "status_code", None) == 429:
+                metrics.increment("survey_sheets_quota_exceeded_total", request=request)
+            raise
+
+    def call(self, name, op, request="read"):
+        """Run op(worksheet), reconnecting once on auth or transport errors
+
+        request is "read" or "write", for quota accounting.
+        """
+        with self._lock:
+            if self._sheet is not None:
+                # Without the pool, every call authorized its own client
+                self.stats["handshakes_avoided"] += 1
+                metrics.increment("survey_sheets_handshakes_avoided_total")
+        try:
+            return self._request(name, op, request)
+        except Exception as e:
+            if not _is_reconnectable(e):
+                raise
+            print(f"Reconnecting to Google Sheets after error: {e}")
+            with self._lock:
+                self.reset()
+                self.stats["reconnects"] += 1
+            metrics.increment("survey_sheets_reconnects_total")
+            return self._request(name, op, request)
+
+
+def _is_reconnectable(e):
+    import requests
+    from gspread.exceptions import APIError
+
+    if isinstance(e, APIError):
+        return getattr(e.response, "status_code", None) in (401, 403)
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionError))
+
+
+pool = SheetsPool()
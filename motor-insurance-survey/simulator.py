@@ -0,0 +1,130 @@
+"""Market-share simulator over the full 1,200-profile design space.
+
+Run with: python simulator.py utilities.csv \\
+    --product "Annual Premium Price=₹15,000; Voluntary Deductible=₹0; Key Coverage Feature=Covers only repair costs; Spare parts used during repairs=Only OEM (original) parts; Claims Experience=Cashless claims at garage" \\
+    --product "..." [--rule first_choice] [--vehicle-class "4 wheeler"]
+"""
+import argparse
+import functools
+
+import numpy as np
+import pandas as pd
+
+from analysis import ATTRIBUTE_SETS, ATTRIBUTES, LEVEL_LOOKUPS, LEVELS, utility_columns
+from design import get_attributes, get_design
+
+RULES = ("share", "first_choice")
+RESPONDENT_CHUNK = 20_000
+
+
+def profile_index(profile, attribute_set="4 wheeler"):
+    """Position in the fullfact design of a profile given as {attribute: label or level index}
+
+    Labels are resolved within attribute_set; unknown labels raise ValueError.
+    """
+    index, stride = 0, 1
+    for attr, n_levels in zip(ATTRIBUTES, LEVELS):
+        level = profile[attr]
+        if not isinstance(level, (int, np.integer)):
+            lookup = LEVEL_LOOKUPS[attribute_set, attr]
+            if level not in lookup:
+                raise ValueError(f"Unknown {attribute_set} level for {attr}: {level!r} (expected one of {list(lookup)})")
+            level = lookup[level]
+        elif not 0 <= level < n_levels:
+            raise ValueError(f"Level index out of range for {attr}: {level}")
+        index += int(level) * stride
+        stride *= n_levels  # fullfact varies the first attribute fastest
+    return index
+
+
+class MarketSimulator:
+    """Respondents x full-design utility matrix, precomputed once
+
+    level_utilities is an (n_respondents, sum(levels)) array of per-level
+    utilities in partworth_table order, e.g. the HB output of analysis.fit_hb.
+    attribute_set names the labels those utilities were fitted on.
+    """
+
+    def __init__(self, level_utilities, weights=None, cache_size=1024, attribute_set="4 wheeler"):
+        if attribute_set not in ATTRIBUTE_SETS:
+            raise ValueError(f"Unknown attribute set: {attribute_set}")
+        self.attribute_set = attribute_set
+        level_utilities = np.asarray(level_utilities, dtype=np.float32)
+        codes, _ = get_design(get_attributes("4 wheeler"))
+        offsets = np.concatenate([[0], np.cumsum(LEVELS)[:-1]])
+        # Utility of a design row = sum of its level utilities
+        self.utilities = np.zeros((len(level_utilities), len(codes)), dtype=np.float32)
+        for i, offset in enumerate(offsets):
+            self.utilities += level_utilities[:, offset + codes[:, i]]
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64) / np.sum(weights)
+        self._cached = functools.lru_cache(maxsize=cache_size)(self._evaluate)
+
+    @classmethod
+    def from_utilities_frame(cls, utilities, attribute_set=None, **kwargs):
+        """Build from analysis.py hb output; attribute_set defaults to the frame's only Attribute Set"""
+        if attribute_set is None:
+            sets = utilities["Attribute Set"].dropna().unique() if "Attribute Set" in utilities else []
+            if len(sets) != 1:
+                raise ValueError(f"Utilities cover attribute sets {list(sets)}; pick one with attribute_set")
+            attribute_set = sets[0]
+        else:
+            utilities = utilities[utilities["Attribute Set"] == attribute_set] if "Attribute Set" in utilities else utilities
+        return cls(utilities[utility_columns()].to_numpy(), attribute_set=attribute_set, **kwargs)
+
+    def _evaluate(self, products, rule):
+        shares = self.evaluate_batch(np.array([products]), rule)[0]
+        shares.flags.writeable = False  # shared by every caller hitting the cache
+        return shares
+
+    def evaluate(self, products, rule="share"):
+        """Shares for one scenario; products are design indices or profile dicts"""
+        products = tuple(p if isinstance(p, (int, np.integer)) else profile_index(p, self.attribute_set) for p in products)
+        return self._cached(tuple(int(p) for p in products), rule)
+
+    def evaluate_batch(self, scenarios, rule="share"):
+        """Shares for many scenarios at once: scenarios is an (n_scenarios, n_products) index array"""
+        if rule not in RULES:
+            raise ValueError(f"Unknown rule: {rule}")
+        scenarios = np.asarray(scenarios)
+        shares = np.zeros(scenarios.shape)
+        for start in range(0, len(self.utilities), RESPONDENT_CHUNK):
+            u = self.utilities[start:start + RESPONDENT_CHUNK][:, scenarios]  # (respondents, scenarios, products)
+            if rule == "share":
+                u = u - u.max(axis=2, keepdims=True)
+                p = np.exp(u)
+                p /= p.sum(axis=2, keepdims=True)
+            else:
+                p = (u == u.max(axis=2, keepdims=True)).astype(np.float32)
+                p /= p.sum(axis=2, keepdims=True)  # split exact ties
+            if self.weights is None:
+                shares += p.sum(axis=0)
+            else:
+                shares += np.einsum('r,rsp->sp', self.weights[start:start + RESPONDENT_CHUNK], p)
+        return shares / len(self.utilities) if self.weights is None else shares
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+
+def _parse_product(text):
+    profile = {}
+    for part in text.split(";"):
+        attr, _, level = part.partition("=")
+        level = level.strip()
+        profile[attr.strip()] = int(level) if level.isdigit() else level
+    return profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("utilities", help="CSV written by 'analysis.py hb --output'")
+    parser.add_argument("--product", action="append", required=True, help="attribute=label pairs separated by ';'")
+    parser.add_argument("--rule", choices=RULES, default="share")
+    parser.add_argument("--vehicle-class", choices=sorted(ATTRIBUTE_SETS),
+                        help="attribute set to simulate; required when the utilities cover both")
+    args = parser.parse_args()
+
+    simulator = MarketSimulator.from_utilities_frame(pd.read_csv(args.utilities), attribute_set=args.vehicle_class)
+    shares = simulator.evaluate([_parse_product(p) for p in args.product], args.rule)
+    for i, share in enumerate(shares):
+        print(f"Product {i + 1}: {share:.1%}")
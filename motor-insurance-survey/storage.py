@@ -0,0 +1,417 @@
+import glob
+import itertools
+import os
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import localdb
+import metrics
+import outbox
+import sheets
+from design import get_attributes
+
+# --------------------------- Response Layout ---------------------------
+
+# Attribute names are shared by every vehicle class; only the levels differ
+ATTRIBUTE_COLUMNS = list(get_attributes("4 wheeler").keys())
+DEMOGRAPHIC_FIELDS = [
+    "Age", "Gender", "Education", "Location", "Family Status", "Family Annual Income", "Top Add-ons"
+]
+VEHICLE_FIELDS = [
+    "Ownership", "Vehicle Kind", "Vehicle Type", "Future_Vehicle_Type",
+    "Vehicle Age", "Vehicle Cost", "Usage", "Driven By", "Insurance",
+    "Trust Factor", "Business Type", "How many vehicles do you own?",
+    "Insurance Type"
+]
+
+# Choices offered for "Top Add-ons"; a response joins three of them with ", "
+ADDONS = [
+    "Zero Depreciation Cover : Ensures that the insurance company will pay the full cost to repair or replace damaged parts of your car, without reducing the amount based on how old the parts are",
+    "Roadside Assistance : Emergency help if your car breaks down — towing, fuel delivery, flat tire fix, emergency hotel accommodation etc.",
+    "Engine Protection : Covers damage to the engine due to water ingress, oil leakage, etc. — not usually included in base policies",
+    "Personal Accident Cover (for Driver & Occupants) : Covers injuries or death of the driver and passengers in an accident",
+    "Consumables Cover : Covers small but essential items like engine oil, nuts & bolts, AC gas, etc., used during repairs",
+    "No Claim Bonus (NCB) Protection : Lets you keep your No Claim Bonus (a discount of 20% to 50% on your premium for not making claims) even if you file a claim during the policy year",
+    "Tyre Protection : Covers repair or replacement costs of tyres damaged by accidents, cuts, or bursts",
+    "Key Replacement : Covers the cost of replacing lost, stolen, or damaged car keys, including reprogramming if needed",
+    "Loss of personal belongings : Covers the loss or damage of personal items inside the car, such as electronics, bags, or valuables, due to theft or an accident",
+    "Battery Protection : Covers the cost of repairing or replacing your car's battery if it gets damaged due to electrical faults or accidents",
+    "Garage Cash : Provides a daily allowance to cover your transportation costs if your car is being repaired at a garage after an accident or breakdown",
+    "Misfueling : Covers the costs associated with repairing damage caused by putting the wrong type of fuel in a vehicle"
+]
+RESPONSE_COLUMNS = ["Respondent id", "Task", "Profile"] + ATTRIBUTE_COLUMNS + ["Chosen"] + DEMOGRAPHIC_FIELDS + VEHICLE_FIELDS
+
+# The commercial vehicle page asks for "Type"; it is stored in the Vehicle Type column
+COMMERCIAL_TYPE_FIELD = "Type"
+
+
+def _vehicle_details(vehicle_info):
+    details = [vehicle_info.get(k, "") for k in VEHICLE_FIELDS]
+    if not details[VEHICLE_FIELDS.index("Vehicle Type")]:
+        details[VEHICLE_FIELDS.index("Vehicle Type")] = vehicle_info.get(COMMERCIAL_TYPE_FIELD, "")
+    return details
+
+
+def build_response_frame(profiles, choices, respondents):
+    """Join assigned profiles with choices and respondent details into RESPONSE_COLUMNS rows
+
+    profiles has Respondent id, Task, Profile and the attribute columns;
+    choices has Respondent id, Task and the chosen profile letter as Choice;
+    respondents has one row per Respondent id with the demographic and vehicle
+    fields. Works for one session or a bulk re-export of many respondents.
+    """
+    frame = profiles.merge(choices[["Respondent id", "Task", "Choice"]], on=["Respondent id", "Task"], how="inner")
+    frame["Chosen"] = (frame["Profile"].to_numpy() == frame["Choice"].to_numpy()).astype(int)
+    details = respondents.reindex(columns=["Respondent id"] + DEMOGRAPHIC_FIELDS + VEHICLE_FIELDS).fillna("")
+    if COMMERCIAL_TYPE_FIELD in respondents:
+        missing = details["Vehicle Type"] == ""
+        details.loc[missing, "Vehicle Type"] = respondents.loc[missing, COMMERCIAL_TYPE_FIELD].fillna("")
+    frame = frame.drop(columns="Choice").merge(details, on="Respondent id", how="left")
+    frame = frame.sort_values(["Respondent id", "Task", "Profile"], kind="stable")
+    return frame.reindex(columns=RESPONSE_COLUMNS)
+
+
+def build_response_rows(df_profiles, responses, respondent_id, demographics, vehicle_info):
+    """One respondent's 24-row block as a list of rows, ready for append_rows"""
+    # Index the choices by task number, then join every profile row against it
+    tasks = df_profiles["Task"].to_numpy()
+    choice_by_task = np.full(tasks.max() + 1, "", dtype=object)
+    for response in responses:
+        choice_by_task[response["Task"]] = response["Choice"]
+    keep = choice_by_task[tasks] != ""
+    profile_letters = df_profiles["Profile"].to_numpy(dtype=object)[keep]
+
+    details = [demographics.get(k, "") for k in DEMOGRAPHIC_FIELDS] + _vehicle_details(vehicle_info)
+    block = np.empty((keep.sum(), len(RESPONSE_COLUMNS)), dtype=object)
+    block[:, 0] = respondent_id
+    block[:, 1] = tasks[keep].tolist()
+    block[:, 2] = profile_letters
+    block[:, 3:3 + len(ATTRIBUTE_COLUMNS)] = df_profiles[ATTRIBUTE_COLUMNS].to_numpy(dtype=object)[keep]
+    block[:, 3 + len(ATTRIBUTE_COLUMNS)] = (profile_letters == choice_by_task[tasks[keep]]).astype(int).tolist()
+    block[:, 4 + len(ATTRIBUTE_COLUMNS):] = details
+    return block.tolist()
+
+
+def _counts_dict(counts):
+    return dict(zip(aggregates.COUNT_COLUMNS, counts))
+
+# --------------------------- Storage Interface ---------------------------
+
+class ResponseStore:
+    """Where submitted responses end up
+
+    append_rows takes rows in RESPONSE_COLUMNS order plus the vehicle kind of
+    each respondent in the batch. read_responses returns the rows added after
+    an opaque integer cursor together with the cursor to pass next time; with
+    limit set it returns roughly that many rows at most, so callers can stream.
+    Cursors only mean something to the store they came from, identified by
+    source (backend and location).
+    """
+
+    @property
+    def source(self):
+        raise NotImplementedError
+
+    def append_rows(self, rows, vehicle_kinds):
+        raise NotImplementedError
+
+    def read_aggregates(self):
+        raise NotImplementedError
+
+    def read_responses(self, since=0, limit=None):
+        raise NotImplementedError
+
+    def iter_responses(self, since=0, chunk_rows=100_000):
+        """Yield DataFrames of at most about chunk_rows rows until the store is exhausted"""
+        while True:
+            df, since = self.read_responses(since, limit=chunk_rows)
+            if df.empty:
+                return
+            yield df
+
+
+class GoogleSheetsStore(ResponseStore):
+    def __init__(self, pool=None):
+        self.pool = pool or sheets.pool
+        self._header = None
+
+    @property
+    def source(self):
+        return f"sheets:{self.pool.sheet_id}"
+
+    def append_rows(self, rows, vehicle_kinds):
+        try:
+            # Send all queued rows in one batch
+            self.pool.call("Final_Responses", lambda ws: ws.append_rows(rows, value_input_option='USER_ENTERED'),
+                           request="write")
+        except Exception as e:
+            print(f"Error while submitting to Google Sheets: {e}")
+            raise
+
+        print("Data successfully added to Google Sheets!")
+        self.update_respondents_data(vehicle_kinds)
+
+    @metrics.timed("survey_storage", backend="GoogleSheetsStore", op="update_respondents_data")
+    def update_respondents_data(self, vehicle_kinds):
+        try:
+            if aggregates.reconcile_due():
+                # Occasional full re-count from the "Final_Responses" sheet
+                counts = aggregates.count_respondents(self.pool.call("Final_Responses", lambda ws: ws.get_all_records()))
+            else:
+                current = self.pool.call("Respondents_Data", lambda ws: ws.get(aggregates.COUNTS_RANGE))
+                counts = aggregates.increment_counts(current[0] if current else [], vehicle_kinds)
+
+            # Update the Respondents_Data sheet in one batched range write
+            self.pool.call("Respondents_Data", lambda ws: ws.update(range_name=aggregates.COUNTS_RANGE, values=[counts]),
+                           request="write")
+
+            print("Respondents data successfully updated.")
+
+        except Exception as e:
+            metrics.increment("survey_storage_errors_total", backend="GoogleSheetsStore", op="update_respondents_data")
+            print(f"Error while updating Respondents_Data: {e}")
+
+    def read_aggregates(self):
+        current = self.pool.call("Respondents_Data", lambda ws: ws.get(aggregates.COUNTS_RANGE))
+        return _counts_dict(aggregates.increment_counts(current[0] if current else [], []))
+
+    def read_responses(self, since=0, limit=None):
+        # Fetch only the rows after the cursor (row 1 is the header), so
+        # iter_responses reads each row once
+        from gspread.utils import rowcol_to_a1
+
+        if self._header is None:
+            header = self.pool.call("Final_Responses", lambda ws: ws.get("1:1"))
+            self._header = header[0] if header else RESPONSE_COLUMNS
+        width = len(self._header)
+        last_column = rowcol_to_a1(1, width).rstrip("0123456789")
+        end = last_column if limit is None else f"{last_column}{since + 1 + limit}"
+        body = self.pool.call("Final_Responses", lambda ws: ws.get(f"A{since + 2}:{end}"))
+        # The API drops trailing empty cells
+        body = [list(row) + [""] * (width - len(row)) for row in body]
+        return pd.DataFrame(body, columns=self._header), since + len(body)
+
+
+class SQLiteStore(ResponseStore):
+    def __init__(self, path):
+        self.path = path
+        columns = ", ".join(f'"{c}"' for c in RESPONSE_COLUMNS)
+        self._insert = f"INSERT INTO responses ({columns}) VALUES ({', '.join('?' * len(RESPONSE_COLUMNS))})"
+        self._schema = f"""
+            CREATE TABLE IF NOT EXISTS responses (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns});
+            CREATE TABLE IF NOT EXISTS respondent_counts (bucket TEXT PRIMARY KEY, n INTEGER NOT NULL);
+        """
+        self._conn()
+
+    @property
+    def source(self):
+        return f"sqlite:{os.path.abspath(self.path)}"
+
+    def _conn(self):
+        return localdb.connect(self.path, self._schema, pragmas=["synchronous=NORMAL"])
+
+    def append_rows(self, rows, vehicle_kinds):
+        counts = aggregates.increment_counts([], vehicle_kinds)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(self._insert, rows)
+            conn.executemany(
+                "INSERT INTO respondent_counts (bucket, n) VALUES (?, ?) ON CONFLICT(bucket) DO UPDATE SET n = n + excluded.n",
+                list(zip(aggregates.COUNT_COLUMNS, counts)),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def read_aggregates(self):
+        stored = dict(self._conn().execute("SELECT bucket, n FROM respondent_counts"))
+        return {c: stored.get(c, 0) for c in aggregates.COUNT_COLUMNS}
+
+    def read_responses(self, since=0, limit=None):
+        columns = ", ".join(f'"{c}"' for c in RESPONSE_COLUMNS)
+        cursor = self._conn().execute(f"SELECT id, {columns} FROM responses WHERE id > ? ORDER BY id LIMIT ?",
+                                      (since, -1 if limit is None else limit))
+        df = pd.DataFrame(cursor.fetchall(), columns=["id"] + RESPONSE_COLUMNS)
+        new_since = int(df["id"].iloc[-1]) if len(df) else since
+        return df.drop(columns="id"), new_since
+
+
+class ParquetStore(ResponseStore):
+    """Append-only directory of Parquet part files, one per flushed batch
+
+    Parts are numbered part-<seq>.parquet. A writer publishes its part by
+    hard-linking it to the next free number. A number is therefore only
+    taken once every lower number exists, even with several processes
+    writing to the same directory, and the cursor is the last sequence
+    number read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def source(self):
+        return f"parquet:{os.path.abspath(self.path)}"
+
+    def _parts(self):
+        """(sequence number, path) of every published part, in order"""
+        parts = []
+        for path in glob.glob(os.path.join(self.path, "part-*.parquet")):
+            seq = os.path.basename(path)[len("part-"):-len(".parquet")]
+            if seq.isdigit():
+                parts.append((int(seq), path))
+        return sorted(parts)
+
+    def append_rows(self, rows, vehicle_kinds):
+        df = pd.DataFrame(rows, columns=RESPONSE_COLUMNS).astype({"Task": "int16", "Chosen": "int8"})
+        tmp = os.path.join(self.path, f".{uuid.uuid4().hex}.tmp")
+        df.to_parquet(tmp, index=False)
+        try:
+            parts = self._parts()
+            seq = parts[-1][0] + 1 if parts else 1
+            while True:
+                try:
+                    os.link(tmp, os.path.join(self.path, f"part-{seq:012d}.parquet"))
+                    break
+                except FileExistsError:
+                    seq += 1  # another writer published this number first
+        finally:
+            os.remove(tmp)
+
+    def read_aggregates(self):
+        parts = self._parts()
+        if not parts:
+            return _counts_dict(aggregates.count_respondents([]))
+        df = pd.concat([pd.read_parquet(p, columns=["Respondent id", "Vehicle Kind", "Ownership"]) for _, p in parts])
+        return _counts_dict(aggregates.count_respondents(df.to_dict("records")))
+
+    def read_responses(self, since=0, limit=None):
+        # The cursor is the sequence number of the last part read; limit stops
+        # after the part that reaches it
+        frames = []
+        n_rows = 0
+        for seq, path in self._parts():
+            if seq <= since:
+                continue
+            frames.append(pd.read_parquet(path))
+            n_rows += len(frames[-1])
+            since = seq
+            if limit is not None and n_rows >= limit:
+                break
+        if not frames:
+            return pd.DataFrame(columns=RESPONSE_COLUMNS), since
+        return pd.concat(frames, ignore_index=True), since
+
+
+class MirroredStore(ResponseStore):
+    """Primary store plus a mirror (e.g. Google Sheets) fed through its own outbox
+
+    Rows reach the mirror through a second outbox at queue_path (drained by
+    outbox.start_flusher(mirror.append_rows, queue_path)), so a mirror outage
+    or 429 delays the copy instead of losing it and never holds up the primary.
+    """
+
+    def __init__(self, primary, mirror, queue_path):
+        self.primary = primary
+        self.mirror = mirror
+        self.queue_path = queue_path
+
+    @property
+    def source(self):
+        return self.primary.source
+
+    def append_rows(self, rows, vehicle_kinds):
+        self.primary.append_rows(rows, vehicle_kinds)
+        try:
+            # One queue entry per respondent block, as in the main outbox
+            blocks = [list(block) for _, block in itertools.groupby(rows, key=lambda row: row[0])]
+            for block, vehicle_kind in zip(blocks, vehicle_kinds):
+                outbox.enqueue(block[0][0], vehicle_kind, block, path=self.queue_path)
+        except Exception as e:
+            # The primary already has the rows; failing here would make the outbox write them twice
+            print(f"Error while queueing responses for the mirror: {e}")
+
+    def read_aggregates(self):
+        return self.primary.read_aggregates()
+
+    def read_responses(self, since=0, limit=None):
+        return self.primary.read_responses(since, limit)
+
+
+class InstrumentedStore(ResponseStore):
+    """Times every call on the wrapped store into metrics, labelled by backend"""
+
+    def __init__(self, store):
+        self.store = store
+        self.backend = type(store).__name__
+
+    @property
+    def source(self):
+        return self.store.source
+
+    def append_rows(self, rows, vehicle_kinds):
+        with metrics.timed("survey_storage", backend=self.backend, op="append_rows"):
+            self.store.append_rows(rows, vehicle_kinds)
+        metrics.increment("survey_storage_rows_written_total", len(rows), backend=self.backend)
+
+    def read_aggregates(self):
+        with metrics.timed("survey_storage", backend=self.backend, op="read_aggregates"):
+            return self.store.read_aggregates()
+
+    def read_responses(self, since=0, limit=None):
+        with metrics.timed("survey_storage", backend=self.backend, op="read_responses"):
+            return self.store.read_responses(since, limit)
+
+# --------------------------- Configuration ---------------------------
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _setting(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        try:
+            import streamlit as st
+            value = st.secrets.get(name)
+        except Exception:
+            value = None
+    return value if value is not None else default
+
+
+def make_store(backend, path=None):
+    if backend == "sheets":
+        return GoogleSheetsStore()
+    if backend == "sqlite":
+        return SQLiteStore(path or "survey_responses.sqlite3")
+    if backend == "parquet":
+        return ParquetStore(path or "survey_responses_parquet")
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def get_store():
+    """Return the process-wide store selected by SURVEY_STORAGE ("sheets", "sqlite" or "parquet")
+
+    SURVEY_STORAGE_PATH sets the local file or directory, and SURVEY_SHEETS_MIRROR=1
+    keeps Google Sheets as a mirror of a local backend, queued in the outbox at
+    SURVEY_MIRROR_OUTBOX_PATH. Settings are read from the environment first,
+    then from st.secrets.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = _setting("SURVEY_STORAGE", "sheets")
+            store = make_store(backend, _setting("SURVEY_STORAGE_PATH", None))
+            if backend != "sheets" and str(_setting("SURVEY_SHEETS_MIRROR", "0")) == "1":
+                queue_path = _setting("SURVEY_MIRROR_OUTBOX_PATH", os.path.join(os.path.dirname(outbox.OUTBOX_PATH), "survey_mirror_outbox.sqlite3"))
+                store = MirroredStore(store, GoogleSheetsStore(), queue_path)
+                outbox.start_flusher(store.mirror.append_rows, queue_path)
+            _store = InstrumentedStore(store)
+    return _store
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+import analysis
+import design
+import storage
+
+
+def _simulate(store, vehicle_type, beta, n_respondents, rng):
+    """Write respondents choosing by MNL with known effects-coded part-worths"""
+    table = design.get_attribute_table(vehicle_type)
+    versions, _ = design.get_design_pool(design.get_attributes(vehicle_type))
+    rows = []
+    for r in range(n_respondents):
+        codes = versions[rng.integers(len(versions))]
+        X = design.effects_code(codes, table.levels).reshape(design.N_TASKS, design.N_ALTERNATIVES, -1)
+        chosen = (X @ beta + rng.gumbel(size=(design.N_TASKS, design.N_ALTERNATIVES))).argmax(axis=1)
+        responses = [{"Task": t + 1, "Choice": design.PROFILE_LETTERS[c]} for t, c in enumerate(chosen)]
+        rows += storage.build_response_rows(table.decode(codes), responses, f"{vehicle_type}-{r}", {},
+                                            {"Vehicle Type": vehicle_type})
+    store.append_rows(rows, [])
+
+
+def test_mnl_recovers_partworths_per_attribute_set(tmp_path):
+    rng = np.random.default_rng(0)
+    beta = rng.normal(scale=0.8, size=analysis.N_PARAMS)
+    store = storage.SQLiteStore(str(tmp_path / "responses.sqlite3"))
+    _simulate(store, "4 wheeler", beta, 1500, rng)
+    _simulate(store, "2 wheeler", beta, 1500, rng)
+
+    data = analysis.load_choice_data(store, chunk_rows=10_000)
+    assert len(data) == 3000 * design.N_TASKS
+    assert set(data.respondents["Attribute Set"]) == {"2 wheeler", "4 wheeler"}
+
+    for vehicle_class in ["2 wheeler", "4 wheeler"]:
+        subset = data.subset((data.respondents["Attribute Set"] == vehicle_class).to_numpy())
+        fitted, _, _ = analysis.fit_mnl(subset)
+        assert np.abs(fitted - beta).max() < 0.2, vehicle_class
+
+
+def test_shared_labels_keep_their_own_level():
+    four = design.get_attributes("4 wheeler")
+    row = {attr: four[attr][1] for attr in analysis.ATTRIBUTES}
+    codes = analysis.encode_levels(pd.DataFrame([row]))
+    # "₹1,000" is level 1 for 4 wheelers even though it is level 2 for 2 wheelers
+    assert codes.tolist() == [[1] * len(analysis.ATTRIBUTES)]
+
+
+def test_hb_checkpoint_from_other_data_is_not_resumed(tmp_path):
+    rng = np.random.default_rng(1)
+    beta = rng.normal(scale=0.8, size=analysis.N_PARAMS)
+    store = storage.SQLiteStore(str(tmp_path / "responses.sqlite3"))
+    _simulate(store, "4 wheeler", beta, 30, rng)
+    _simulate(store, "2 wheeler", beta, 20, rng)
+    data = analysis.load_choice_data(store)
+    checkpoints = str(tmp_path / "hb")
+
+    analysis.fit_hb(data, chains=1, iterations=20, burn_in=10, checkpoint_dir=checkpoints, workers=1)
+    two_wheelers = data.subset((data.respondents["Attribute Set"] == "2 wheeler").to_numpy())
+    utilities, _ = analysis.fit_hb(two_wheelers, chains=1, iterations=20, burn_in=10, checkpoint_dir=checkpoints, workers=1)
+
+    assert len(utilities) == 20
+    assert utilities["Respondent id"].str.startswith("2 wheeler-").all()
+    assert utilities[analysis.utility_columns()].notna().all().all()
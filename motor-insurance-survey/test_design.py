@@ -0,0 +1,39 @@
+import numpy as np
+
+import design
+
+LEVELS = [len(v) for v in design.get_attributes("4 wheeler").values()]
+
+
+def test_balanced_versions_are_balanced_without_overlap():
+    versions = design._balanced_versions(LEVELS, np.random.default_rng(0), 500)
+    assert versions.shape == (500, design.N_TASKS * design.N_ALTERNATIVES, len(LEVELS))
+    assert versions.dtype == np.int8
+
+    tasks = versions.reshape(500, design.N_TASKS, design.N_ALTERNATIVES, len(LEVELS))
+    for i, n_levels in enumerate(LEVELS):
+        counts = np.stack([np.bincount(v[:, i], minlength=n_levels) for v in versions])
+        assert counts.shape[1] == n_levels
+        assert (counts.max(axis=1) - counts.min(axis=1) <= 1).all()
+        # Zero overlap: all three alternatives of a task differ on every attribute
+        column = np.sort(tasks[..., i], axis=-1)
+        assert (np.diff(column, axis=-1) > 0).all()
+
+
+def test_versions_never_repeat_a_profile():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        version = design.make_version(LEVELS, rng)
+        assert len(np.unique(version, axis=0)) == len(version)
+
+
+def test_pool_is_efficient_and_cached():
+    attributes = design.get_attributes("4 wheeler")
+    versions, stats = design.get_design_pool(attributes, n_versions=20, seed=0)
+    assert design.get_design_pool(attributes, n_versions=20, seed=0)[0] is versions
+    assert not versions.flags.writeable
+    assert (stats["overlap"] == 0).all()
+    assert np.isfinite(stats["d_error"]).all()
+    # Best-of-candidates versions beat a single random balanced version on average
+    random_errors = design.d_errors(design._balanced_versions(LEVELS, np.random.default_rng(2), 200), LEVELS)
+    assert stats["d_error"].mean() < np.mean(random_errors)
@@ -0,0 +1,65 @@
+import pyarrow as pa
+import pytest
+
+import design
+import export
+import storage
+
+
+def _submit(store, respondent_ids):
+    rows = []
+    for respondent_id in respondent_ids:
+        table, codes = design.generate_profile_codes("4 wheeler")
+        responses = [{"Task": t, "Choice": "B"} for t in range(1, design.N_TASKS + 1)]
+        rows += storage.build_response_rows(table.decode(codes), responses, respondent_id,
+                                            {"Top Add-ons": ", ".join(storage.ADDONS[:3])}, {"Vehicle Kind": "Private"})
+    store.append_rows(rows, ["Private"] * len(respondent_ids))
+
+
+@pytest.mark.parametrize("part_format", sorted(export.PART_FORMATS))
+def test_chunked_export_is_incremental(tmp_path, part_format):
+    store = storage.SQLiteStore(str(tmp_path / "responses.sqlite3"))
+    output = str(tmp_path / "export")
+    rows_per_respondent = design.N_TASKS * design.N_ALTERNATIVES
+
+    _submit(store, [f"r{i}" for i in range(5)])
+    # Chunks that split respondents still count each of them once
+    assert export.export_responses(output, store, chunk_rows=rows_per_respondent + 5, part_format=part_format) == 5
+    _submit(store, [f"r{i}" for i in range(5, 7)])
+    assert export.export_responses(output, store, part_format=part_format) == 2
+    assert export.export_responses(output, store, part_format=part_format) == 0
+
+    watermark = export.read_watermark(output)
+    assert watermark["respondents"] == 7
+    assert watermark["source"] == store.source
+    table = export.read_export(output)
+    assert table.num_rows == 7 * rows_per_respondent
+    assert table.schema.equals(export.export_schema())
+    assert set(table.column("Respondent id").to_pylist()) == {f"r{i}" for i in range(7)}
+    assert set(table.column(export.ADDON_MASK_COLUMN).to_pylist()) == {0b111}
+
+
+def test_arrow_parts_are_read_without_copying(tmp_path):
+    store = storage.SQLiteStore(str(tmp_path / "responses.sqlite3"))
+    output = str(tmp_path / "export")
+    _submit(store, ["r0", "r1"])
+    export.export_responses(output, store, part_format="arrow")
+
+    allocated = pa.total_allocated_bytes()
+    table = export.read_export(output)
+    assert pa.total_allocated_bytes() == allocated
+    assert table.num_rows == 2 * design.N_TASKS * design.N_ALTERNATIVES
+
+
+def test_watermark_from_another_store_is_refused(tmp_path):
+    output = str(tmp_path / "export")
+    first = storage.SQLiteStore(str(tmp_path / "first.sqlite3"))
+    _submit(first, ["r0"])
+    export.export_responses(output, first)
+
+    second = storage.ParquetStore(str(tmp_path / "parts"))
+    _submit(second, ["r1"])
+    with pytest.raises(ValueError, match="source"):
+        export.export_responses(output, second)
+    with pytest.raises(ValueError, match="format"):
+        export.export_responses(output, first, part_format="arrow")
@@ -0,0 +1,26 @@
+import design
+import fieldwork
+import storage
+
+
+def _submission(respondent_id, vehicle_info):
+    table, codes = design.generate_profile_codes("4 wheeler")
+    responses = [{"Task": t, "Choice": "A"} for t in range(1, design.N_TASKS + 1)]
+    return storage.build_response_rows(table.decode(codes), responses, respondent_id, {"Location": "Pune"}, vehicle_info)
+
+
+def test_vehicle_type_breakdown_covers_every_path(tmp_path):
+    path = str(tmp_path / "aggregates.sqlite3")
+    rows = (_submission("private", {"Ownership": "Own Vehicle", "Vehicle Kind": "Private", "Vehicle Type": "4 wheeler"})
+            + _submission("commercial", {"Ownership": "Own Vehicle", "Vehicle Kind": "Commercial", "Type": "Trucks"})
+            + _submission("none", {"Ownership": "No Vehicle", "Future_Vehicle_Type": "EV 2 Wheeler"}))
+    fieldwork.record_submissions(rows, path=path)
+
+    counts = fieldwork.read_fieldwork(path)
+    assert counts["vehicle_type"].to_dict() == {
+        "Commercial | Trucks": 1,
+        "No Vehicle | EV 2 Wheeler": 1,
+        "Private | 4 wheeler": 1,
+    }
+    assert counts["respondents"]["Total"] == 3
+    assert counts["location"]["Pune"] == 3
@@ -0,0 +1,80 @@
+import pytest
+
+import metrics
+import outbox
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = type("Response", (), {"status_code": status_code})()
+
+
+class WorksheetNotFound(Exception):
+    pass
+
+
+class Sink:
+    """Records delivered rows; raises error for batches containing a row in bad (or every batch if bad is empty)"""
+
+    def __init__(self, error=None, bad=()):
+        self.error, self.bad, self.rows = error, set(bad), []
+
+    def __call__(self, rows, vehicle_kinds):
+        if self.error is not None and (not self.bad or self.bad & {r[0] for r in rows}):
+            raise self.error
+        self.rows += rows
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    for respondent in ["r1", "r2", "r3"]:
+        outbox.enqueue(respondent, "Private", [[respondent, "row"]], path=path)
+    return path
+
+
+def test_healthy_sink_drains_in_one_batch(path):
+    sink = Sink()
+    assert outbox.flush_once(sink, path) == 3
+    assert [r[0] for r in sink.rows] == ["r1", "r2", "r3"]
+    assert outbox.pending_count(path) == 0
+
+
+def test_retryable_error_releases_the_batch(path):
+    with pytest.raises(HTTPError):
+        outbox.flush_once(Sink(HTTPError(429)), path)
+    assert outbox.pending_count(path) == 3
+    assert outbox.dead_letter_count(path) == 0
+    # Released entries are claimable again straight away
+    assert outbox.flush_once(Sink(), path) == 3
+
+
+def test_one_bad_submission_is_dead_lettered(path):
+    metrics.reset()
+    sink = Sink(ValueError("bad row"), bad={"r2"})
+    assert outbox.flush_once(sink, path) == 2
+    assert [r[0] for r in sink.rows] == ["r1", "r3"]
+    assert outbox.pending_count(path) == 0
+    assert outbox.dead_letter_count(path) == 1
+    counters = {c["name"]: c["value"] for c in metrics.snapshot()["counters"]}
+    assert counters["survey_outbox_dead_letter_total"] == 1
+
+
+def test_broken_sink_dead_letters_nothing(path):
+    # Every entry failing means the sink is misconfigured, not the payloads
+    for _ in range(outbox.MAX_BATCH_ATTEMPTS + 1):
+        with pytest.raises(WorksheetNotFound):
+            outbox.flush_once(Sink(WorksheetNotFound("Responses")), path)
+    assert outbox.pending_count(path) == 3
+    assert outbox.dead_letter_count(path) == 0
+
+
+def test_requeue_dead_restores_pending(path):
+    outbox.flush_once(Sink(ValueError("bad row"), bad={"r2"}), path)
+    assert outbox.requeue_dead(path) == 1
+    assert outbox.dead_letter_count(path) == 0
+    sink = Sink()
+    assert outbox.flush_once(sink, path) == 1
+    assert sink.rows == [["r2", "row"]]
+
@@ -0,0 +1,33 @@
+import sessions
+
+
+def test_resume_link_works_once(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    assert sessions.save("r1", {"page": "survey"}, "t1", path=path)
+    assert sessions.load("r1", "t1", path=path) == {"page": "survey"}
+    assert sessions.load("r1", "wrong", path=path) is None
+    assert sessions.load("r1", "", path=path) is None
+
+    # Resuming rotates the token; the copied link no longer matches
+    assert sessions.save("r1", {"page": "survey"}, "t2", "t1", path=path)
+    assert sessions.load("r1", "t1", path=path) is None
+    assert sessions.load("r1", "t2", path=path) == {"page": "survey"}
+
+
+def test_session_that_lost_its_checkpoint_cannot_overwrite_it(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    sessions.save("r1", {"page": "survey", "task_index": 1}, "sender", path=path)
+    sessions.save("r1", {"page": "survey", "task_index": 1}, "recipient", "sender", path=path)
+
+    assert not sessions.save("r1", {"page": "survey", "task_index": 2}, "sender-2", "sender", path=path)
+    assert not sessions.finish("r1", "sender", path=path)
+    assert sessions.load("r1", "recipient", path=path) == {"page": "survey", "task_index": 1}
+
+
+def test_finished_sessions_are_not_resumed(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    sessions.save("r1", {"page": "demographics"}, "t1", path=path)
+    assert sessions.finish("r1", "t1", path=path)
+    assert sessions.load("r1", "t1", path=path) is None
+    # Finishing twice (e.g. a retried submit) still claims the id
+    assert sessions.finish("r1", "t1", path=path)
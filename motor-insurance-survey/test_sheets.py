@@ -0,0 +1,28 @@
+import metrics
+import sheets
+
+
+class FakeSheet:
+    def worksheet(self, name):
+        return name
+
+
+class FakePool(sheets.SheetsPool):
+    def _connect(self):
+        self._sheet = FakeSheet()
+        self._worksheets = {}
+        self.stats["handshakes"] += 1
+
+
+def test_handshakes_avoided_counts_calls_on_a_live_client():
+    metrics.reset()
+    pool = FakePool()
+    for _ in range(3):
+        assert pool.call("Final_Responses", lambda ws: ws) == "Final_Responses"
+    pool.call("Respondents_Data", lambda ws: ws, request="write")
+
+    assert pool.stats["handshakes"] == 1
+    assert pool.stats["handshakes_avoided"] == 3
+    counters = {c["name"]: c["value"] for c in metrics.snapshot()["counters"] if not c["labels"]}
+    assert counters["survey_sheets_handshakes_avoided_total"] == 3
+    assert "survey_sheets_handshakes_avoided_total 3" in metrics.render_prometheus()
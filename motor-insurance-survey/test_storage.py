@@ -0,0 +1,123 @@
+import concurrent.futures
+import random
+
+import pytest
+
+import design
+import outbox
+import storage
+
+
+def _rows(respondent_id, n=2):
+    rows = []
+    for task in range(1, n + 1):
+        row = dict.fromkeys(storage.RESPONSE_COLUMNS, "")
+        row.update({"Respondent id": respondent_id, "Task": task, "Profile": "A", "Chosen": int(task == 1)})
+        rows.append(list(row.values()))
+    return rows
+
+
+class FlakySheets:
+    def __init__(self):
+        self.down, self.rows, self.kinds = True, [], []
+
+    def append_rows(self, rows, vehicle_kinds):
+        if self.down:
+            raise ConnectionError("Sheets unavailable")
+        self.rows += rows
+        self.kinds += vehicle_kinds
+
+
+def test_mirror_outage_delays_rows_instead_of_dropping_them(tmp_path):
+    primary = storage.SQLiteStore(str(tmp_path / "responses.sqlite3"))
+    queue = str(tmp_path / "mirror_outbox.sqlite3")
+    sheets = FlakySheets()
+    store = storage.MirroredStore(primary, sheets, queue)
+
+    store.append_rows(_rows("r1") + _rows("r2"), ["Private", "Commercial"])
+    assert len(primary.read_responses()[0]) == 4
+    assert outbox.pending_count(queue) == 2
+
+    with pytest.raises(ConnectionError):
+        outbox.flush_once(sheets.append_rows, queue)
+    assert outbox.pending_count(queue) == 2
+
+    sheets.down = False
+    assert outbox.flush_once(sheets.append_rows, queue) == 2
+    assert [row[0] for row in sheets.rows] == ["r1", "r1", "r2", "r2"]
+    assert sheets.kinds == ["Private", "Commercial"]
+
+
+def test_sqlite_round_trip(tmp_path):
+    store = storage.SQLiteStore(str(tmp_path / "responses.sqlite3"))
+    rows = _rows("r1", 3) + _rows("r2", 3)
+    store.append_rows(rows, ["Private", "No Vehicle"])
+
+    df, cursor = store.read_responses()
+    assert list(df.columns) == storage.RESPONSE_COLUMNS
+    assert df.values.tolist() == rows
+    assert store.read_aggregates() == {"Total": 2, "Private": 1, "Commercial": 0, "No Vehicle": 1}
+
+    # The same file opened again continues from the cursor
+    store.append_rows(_rows("r3"), ["Commercial"])
+    reopened = storage.SQLiteStore(store.path)
+    assert reopened.read_responses(cursor)[0]["Respondent id"].tolist() == ["r3", "r3"]
+    assert [len(df) for df in reopened.iter_responses(chunk_rows=4)] == [4, 4]
+
+
+def _write_parts(path, writer, n):
+    store = storage.ParquetStore(path)
+    for i in range(n):
+        store.append_rows(_rows(f"{writer}-{i}", 1), ["Private"])
+
+
+def test_parquet_cursor_sees_every_part_from_two_writers(tmp_path):
+    path = str(tmp_path / "parts")
+    reader = storage.ParquetStore(path)
+    seen, cursor = [], 0
+    with concurrent.futures.ProcessPoolExecutor(2) as pool:
+        writers = [pool.submit(_write_parts, path, writer, 30) for writer in ["a", "b"]]
+        # Read while both processes are still publishing parts
+        while not all(w.done() for w in writers):
+            df, cursor = reader.read_responses(cursor, limit=7)
+            seen += df["Respondent id"].tolist()
+        for w in writers:
+            w.result()
+    df, cursor = reader.read_responses(cursor)
+    seen += df["Respondent id"].tolist()
+
+    assert sorted(seen) == sorted(f"{w}-{i}" for w in "ab" for i in range(30))
+    assert [seq for seq, _ in reader._parts()] == list(range(1, 61))
+    assert reader.read_aggregates()["Total"] == 60
+
+
+def _legacy_response_rows(df_profiles, responses, respondent_id, demographics, vehicle_info):
+    # The per-cell loop build_response_rows replaced
+    rows = []
+    for response in sorted(responses, key=lambda x: x["Task"]):
+        task = response["Task"]
+        for profile_letter in ["A", "B", "C"]:
+            profile = df_profiles[(df_profiles["Task"] == task) & (df_profiles["Profile"] == profile_letter)].iloc[0]
+            row = [respondent_id, task, profile_letter]
+            row += [profile[attr] for attr in storage.ATTRIBUTE_COLUMNS]
+            row.append(1 if profile_letter == response["Choice"] else 0)
+            row += [demographics.get(k, "") for k in storage.DEMOGRAPHIC_FIELDS]
+            row += [vehicle_info.get(k, "") for k in storage.VEHICLE_FIELDS]
+            rows.append(row)
+    return rows
+
+
+def test_build_response_rows_matches_legacy_output():
+    rng = random.Random(0)
+    demographics = {"Age": "34", "Location": "Pune", "Top Add-ons": ", ".join(storage.ADDONS[:3])}
+    vehicle_info = {"Ownership": "Own Vehicle", "Vehicle Kind": "Private", "Vehicle Type": "2 wheeler", "Usage": "Light"}
+    for vehicle_type in ["2 wheeler", "4 wheeler"]:
+        table, codes = design.generate_profile_codes(vehicle_type)
+        df_profiles = table.decode(codes)
+        # Answers arrive out of order, and an unanswered task is left out
+        tasks = rng.sample(range(1, design.N_TASKS + 1), design.N_TASKS - 1)
+        responses = [{"Task": t, "Choice": rng.choice("ABC")} for t in tasks]
+
+        rows = storage.build_response_rows(df_profiles, responses, "r1", demographics, vehicle_info)
+        assert rows == _legacy_response_rows(df_profiles, responses, "r1", demographics, vehicle_info)
+        assert len(rows) == (design.N_TASKS - 1) * design.N_ALTERNATIVES